@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""Benchmarks for the filtered_logger module.
+
+Usage:
+    python3 benchmark.py parallel [--lines N]
+    python3 benchmark.py export [--rows N]
+    python3 benchmark.py redaction [--output FILE] [--baseline FILE]
+"""
+import os
+import re
+import csv
+import sys
+import json
+import time
+import stdlib_logging  # noqa: F401, must come before logging
+import logging
+import sqlite3
+import functools
+import argparse
+import itertools
+import tempfile
+import tracemalloc
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import filtered_logger
+
+
+# records holding characters str.splitlines takes for line breaks, or a
+# lone \r, which serial and parallel redaction must treat the same
+EDGE_RECORDS = [
+    "name=al\x0cice;ssn=1\x85234;\n",
+    "name=b\x0bob;email=b\x1cb@x;phone=\x1d1\x1e2;\n",
+    "name=c\u2028c;ssn=9\u20299;\r\n",
+    "name=dan;ssn=42;\rname=eve;password=pw;\n",
+]
+
+
+def write_log_corpus(path: str, lines: int) -> None:
+    """Write a log file of `key=value;` user records.
+
+    Every thousandth record is one of EDGE_RECORDS.
+
+    Args:
+        path (str): Where to write the corpus.
+        lines (int): Number of records to write.
+    """
+    template = ("name=User {0};email=user{0}@example.com;phone=(473) 401-{1};"
+                "ssn=261-72-{1};password=K5?BMNv{0};ip=60ed:c396::{0:x};"
+                "last_login=2019-11-14 06:14:24;user_agent=Mozilla/5.0;\n")
+    with open(path, "w", buffering=1 << 20, newline="") as f:
+        f.writelines(
+            EDGE_RECORDS[i // 1000 % len(EDGE_RECORDS)]
+            if i % 1000 == 999 else template.format(i, str(i % 10000).zfill(4))
+            for i in range(lines))
+
+
+def bench_parallel(lines: int) -> List[dict]:
+    """Measure redaction throughput for an increasing number of workers.
+
+    Args:
+        lines (int): Number of records in the generated corpus.
+
+    Returns:
+        List[dict]: One result per worker count, with its speedup over the
+        single process `redact_file`.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, "in.log"), os.path.join(tmp, "out.log")
+        write_log_corpus(src, lines)
+        baseline = filtered_logger.redact_file(src, dst)
+        results.append(dict(baseline, workers="serial", speedup=1.0))
+        with open(dst, "rb") as f:
+            serial = f.read()
+        workers, cpus = 1, os.cpu_count() or 1
+        while True:
+            stats = filtered_logger.redact_file_parallel(
+                src, dst, workers=workers, chunk_size=4 << 20)
+            with open(dst, "rb") as f:
+                if f.read() != serial or stats["lines"] != baseline["lines"]:
+                    raise AssertionError(
+                        "parallel redaction with {} workers differs from "
+                        "redact_file".format(workers))
+            speedup = baseline["seconds"] / stats["seconds"]
+            results.append(dict(stats, workers=workers, speedup=speedup))
+            if workers >= cpus:
+                break
+            workers = min(workers * 2, cpus)
+    return results
+
+
+def read_user_data() -> Tuple[List[str], List[List[str]]]:
+    """Read the header and records of user_data.csv"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "user_data.csv")
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        return header, list(reader)
+
+
+def users_db(rows: int) -> sqlite3.Connection:
+    """Create an in-memory SQLite stand-in for `get_db`.
+
+    The users table has the columns of user_data.csv and is filled by
+    cycling through its records.
+
+    Args:
+        rows (int): Number of rows in the users table.
+
+    Returns:
+        sqlite3.Connection: The connection to the database.
+    """
+    header, records = read_user_data()
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE users ({})".format(
+        ", ".join("{} TEXT".format(column) for column in header)))
+    db.executemany(
+        "INSERT INTO users VALUES ({})".format(", ".join("?" * len(header))),
+        itertools.islice(itertools.cycle(records), rows))
+    return db
+
+
+def bench_export(rows: int) -> List[dict]:
+    """Measure `export_users` for several batch sizes and handlers.
+
+    Records are written to os.devnull. Each combination is run twice: once
+    for its throughput and once under tracemalloc for its memory peak.
+
+    Args:
+        rows (int): Number of rows in the users table.
+
+    Returns:
+        List[dict]: One result per (handler, batch size) combination.
+    """
+    def run(queued, batch_size):
+        if queued:
+            handler = filtered_logger.QueueingHandler(devnull)
+        else:
+            handler = logging.StreamHandler(devnull)
+        handler.setFormatter(filtered_logger.RedactingFormatter(
+            filtered_logger.PII_FIELDS))
+        logger = logging.Logger("bench_export")
+        logger.addHandler(handler)
+        stats = filtered_logger.export_users(db, logger, batch_size)
+        handler.close()
+        return stats
+
+    results = []
+    db = users_db(rows)
+    with open(os.devnull, "w") as devnull:
+        for queued, batch_size in itertools.product(
+                (False, True), (1, 100, 1000, 10000)):
+            stats = run(queued, batch_size)
+            tracemalloc.start()
+            run(queued, batch_size)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append(dict(stats, queued=queued, batch_size=batch_size,
+                                peak_bytes=peak))
+    db.close()
+    return results
+
+
+def legacy_filter_datum(fields: List[str], redaction: str,
+                        message: str, separator: str) -> str:
+    """The original filter_datum, building its pattern on every call"""
+    extract, replace = (
+        lambda x, y: r'(?P<field>{})=[^{}]*'.format('|'.join(x), y),
+        lambda x: r'\g<field>={}'.format(x))
+    return re.sub(extract(fields, separator), replace(redaction), message)
+
+
+IMPLEMENTATIONS: Dict[str, Callable[[List[str], str, str, str], str]] = {
+    "legacy": legacy_filter_datum,
+    "engine": filtered_logger.filter_datum,
+    "trie": functools.partial(filtered_logger.filter_datum, matcher="trie"),
+}
+
+
+def synthetic_message(length: int, fields: Sequence[str], matches: int,
+                      separator: str) -> str:
+    """Build a `key=value` message of about `length` characters.
+
+    The first `matches` pairs use PII fields, the rest are filler pairs
+    that the redaction must scan past without matching.
+    """
+    pairs = ["{}=value{}".format(fields[i % len(fields)], i)
+             for i in range(matches)]
+    i = 0
+    while sum(map(len, pairs)) + len(pairs) < length:
+        pairs.append("info{}=filler{}".format(i, i))
+        i += 1
+    return separator.join(pairs) + separator
+
+
+def user_data_messages(separator: str = ";") -> List[str]:
+    """Render every user_data.csv record as a `key=value` message"""
+    header, records = read_user_data()
+    return ["".join("{}={}{}".format(key, value, separator)
+                    for key, value in zip(header, record))
+            for record in records]
+
+
+def redaction_cases() -> List[dict]:
+    """The grid of synthetic cases, plus the user_data.csv corpus"""
+    cases = [{"corpus": "user_data", "length": None, "fields": 5,
+              "matches": 5, "separator": ";"}]
+    for length, n_fields, matches, separator in itertools.product(
+            (64, 512, 4096), (5, 50, 500), (0, 1, 5), (";", "|")):
+        cases.append({"corpus": "synthetic", "length": length,
+                      "fields": n_fields, "matches": matches,
+                      "separator": separator})
+    return cases
+
+
+def case_fields(n_fields: int) -> List[str]:
+    """PII_FIELDS padded with made up field names up to `n_fields`"""
+    fields = list(filtered_logger.PII_FIELDS)
+    fields += ["field{}".format(i) for i in range(n_fields - len(fields))]
+    return fields[:n_fields]
+
+
+def time_calls(function: Callable, args_list: List[tuple],
+               repeat: int = 5, min_time: float = 0.05) -> float:
+    """Best time in seconds for one pass over `args_list`"""
+    best = float("inf")
+    for _ in range(repeat):
+        loops, elapsed = 0, 0.0
+        start = time.perf_counter()
+        while elapsed < min_time:
+            for args in args_list:
+                function(*args)
+            loops += 1
+            elapsed = time.perf_counter() - start
+        best = min(best, elapsed / loops)
+    return best
+
+
+def bench_redaction(implementations: Sequence[str] = None) -> List[dict]:
+    """Time each filter_datum implementation over every case.
+
+    Args:
+        implementations (Sequence[str]): Names from IMPLEMENTATIONS, all of
+            them by default.
+
+    Returns:
+        List[dict]: One result per (case, implementation), with the time per
+        message in nanoseconds and the throughput in MB/sec.
+    """
+    redaction = filtered_logger.RedactingFormatter.REDACTION
+    results = []
+    for case in redaction_cases():
+        fields = case_fields(case["fields"])
+        if case["corpus"] == "user_data":
+            messages = user_data_messages(case["separator"])
+        else:
+            messages = [synthetic_message(case["length"], fields,
+                                          case["matches"], case["separator"])]
+        size = sum(map(len, messages))
+        args_list = [(fields, redaction, message, case["separator"])
+                     for message in messages]
+        for name in implementations or IMPLEMENTATIONS:
+            if name not in IMPLEMENTATIONS:
+                continue
+            seconds = time_calls(IMPLEMENTATIONS[name], args_list)
+            results.append(dict(
+                case, implementation=name,
+                ns_per_message=seconds / len(messages) * 1e9,
+                mb_per_sec=size / (1 << 20) / seconds))
+    if not implementations or set(implementations) & set(FORMATTERS):
+        results.extend(bench_formatter(implementations))
+    return results
+
+
+class ScanningFormatter(filtered_logger.RedactingFormatter):
+    """RedactingFormatter running the engine over every message"""
+
+    def _plain_template(self, template: str) -> bool:
+        """never skip the scan of a rendered template"""
+        return False
+
+    def _plain_key(self, key) -> bool:
+        """never skip the scan of a rendered payload"""
+        return False
+
+
+FORMATTERS = {
+    "formatter": filtered_logger.RedactingFormatter,
+    "formatter_scan": ScanningFormatter,
+}
+
+
+def user_data_records() -> Dict[str, List[Tuple[str, object, dict]]]:
+    """The user_data.csv records as (msg, args, payload) log calls
+
+    "free_text" renders them before logging, "mapping_args" passes them
+    to a `key=%(key)s;` template and "payload" as extra={"payload": ...}.
+    """
+    header, records = read_user_data()
+    template = "".join("{0}=%({0})s;".format(key) for key in header)
+    rows = [dict(zip(header, record)) for record in records]
+    return {
+        "free_text": [(template % row, None, None) for row in rows],
+        "mapping_args": [(template, row, None) for row in rows],
+        "payload": [("user record", None, row) for row in rows],
+    }
+
+
+def bench_formatter(implementations: Sequence[str] = None) -> List[dict]:
+    """Time RedactingFormatter.format over free-text and structured records.
+
+    "formatter_scan" is the formatter scanning every rendered message,
+    which structured records no longer need when their keys say it all.
+    """
+    record = logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                               "", None, None)
+
+    def format_record(formatter, msg, args, payload):
+        record.msg, record.args = msg, args
+        record.payload = payload
+        formatter.format(record)
+
+    results = []
+    for corpus, calls in user_data_records().items():
+        size = sum(len(msg % args if args else msg) + sum(
+            len("{}={};".format(*pair)) for pair in (payload or {}).items())
+            for msg, args, payload in calls)
+        for name in implementations or FORMATTERS:
+            if name not in FORMATTERS:
+                continue
+            formatter = FORMATTERS[name](list(filtered_logger.PII_FIELDS))
+            seconds = time_calls(format_record, [
+                (formatter, msg, args, payload)
+                for msg, args, payload in calls])
+            results.append(dict(
+                corpus=corpus, length=None, fields=len(formatter.fields),
+                matches=None, separator=formatter.SEPARATOR,
+                implementation=name,
+                ns_per_message=seconds / len(calls) * 1e9,
+                mb_per_sec=size / (1 << 20) / seconds))
+    return results
+
+
+def regressions(results: List[dict], baseline: List[dict],
+                tolerance: float = 0.1) -> List[Tuple[dict, float]]:
+    """Results slower than their baseline by more than `tolerance`.
+
+    Returns:
+        List[Tuple[dict, float]]: Each regressed result with its slowdown
+        ratio against the baseline.
+    """
+    def key(result):
+        return tuple(result.get(k) for k in (
+            "corpus", "length", "fields", "matches", "separator",
+            "implementation"))
+
+    before = {key(result): result for result in baseline}
+    slower = []
+    for result in results:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        ratio = result["ns_per_message"] / old["ns_per_message"]
+        if ratio > 1 + tolerance:
+            slower.append((result, ratio))
+    return slower
+
+
+def main(argv: List[str] = None) -> None:
+    """Run the benchmark named on the command line"""
+    parser = argparse.ArgumentParser(prog="benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    parallel = commands.add_parser("parallel",
+                                   help="scaling of parallel redaction")
+    parallel.add_argument("--lines", type=int, default=1000000)
+    export = commands.add_parser("export",
+                                 help="streaming export of the users table")
+    export.add_argument("--rows", type=int, default=100000)
+    redaction = commands.add_parser(
+        "redaction", help="filter_datum implementations and formatters")
+    redaction.add_argument("--implementations", default=None,
+                           help="comma separated names, all by default")
+    redaction.add_argument("--output", default=None,
+                           help="write the JSON results to this file")
+    redaction.add_argument("--baseline", default=None,
+                           help="JSON results to check for regressions")
+    redaction.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.command == "parallel":
+        for result in bench_parallel(args.lines):
+            print("workers={:<6} {:>10.0f} lines/sec  {:>6.1f} MB/sec  "
+                  "x{:.2f}".format(
+                      result["workers"],
+                      result["lines"] / result["seconds"],
+                      result["bytes"] / (1 << 20) / result["seconds"],
+                      result["speedup"]))
+    elif args.command == "export":
+        for result in bench_export(args.rows):
+            print("queued={!s:<5} batch_size={:<6} {:>9.0f} rows/sec  "
+                  "peak {:>7.1f} KB".format(
+                      result["queued"], result["batch_size"],
+                      result["rows"] / result["seconds"],
+                      result["peak_bytes"] / 1024))
+    elif args.command == "redaction":
+        names = args.implementations and args.implementations.split(",")
+        results = bench_redaction(names)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=1)
+        else:
+            json.dump(results, sys.stdout, indent=1)
+            print()
+        if args.baseline:
+            with open(args.baseline) as f:
+                slower = regressions(results, json.load(f), args.tolerance)
+            for result, ratio in slower:
+                print("regression x{:.2f}: {}".format(ratio, json.dumps(
+                    result, sort_keys=True)), file=sys.stderr)
+            if slower:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
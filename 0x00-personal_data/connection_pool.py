@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Module for pooling database connections.
+
+The pool works with any DB-API connect factory, e.g. `mysql.connector.connect`
+or `sqlite3.connect`, wrapped in a callable taking no arguments.
+
+Classes:
+    ConnectionPool: Bounded pool with health checks and idle eviction.
+    PooledConnection: Connection proxy whose `close` returns it to the pool.
+"""
+import time
+import threading
+import collections
+from typing import Any, Callable, List
+
+
+class PooledConnection:
+    """Proxy to a connection checked out of a `ConnectionPool`.
+
+    Every attribute is forwarded to the real connection, except `close`
+    which gives the connection back to the pool.
+    """
+
+    def __init__(self, pool: "ConnectionPool", connection: Any):
+        """wrap a checked out connection"""
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name: str) -> Any:
+        """forward to the real connection"""
+        if self._connection is None:
+            raise AttributeError("connection returned to the pool")
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """return the connection to the pool"""
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool.release(connection)
+
+    def __enter__(self) -> "PooledConnection":
+        """use the connection as a context manager"""
+        return self
+
+    def __exit__(self, *exc) -> None:
+        """return the connection to the pool"""
+        self.close()
+
+
+def ping(connection: Any) -> bool:
+    """Check that a connection is usable by running a trivial query.
+
+    Args:
+        connection: A DB-API connection.
+
+    Returns:
+        bool: True if the query succeeded.
+    """
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections.
+
+    Connections are health checked when they are checked out and those left
+    idle longer than `idle_timeout` are closed, down to `min_size`. Idle
+    connections are reused most recently used first, so the extra ones
+    eventually idle out after a burst.
+    """
+
+    def __init__(self, connect: Callable[[], Any], min_size: int = 1,
+                 max_size: int = 5, idle_timeout: float = 300.0,
+                 checkout_timeout: float = 30.0,
+                 health_check: Callable[[Any], bool] = ping):
+        """Create the pool and open `min_size` connections.
+
+        Args:
+            connect (Callable): Factory returning a new connection.
+            min_size (int): Number of connections kept open.
+            max_size (int): Maximum number of open connections.
+            idle_timeout (float): Seconds before an idle connection beyond
+                `min_size` is closed.
+            checkout_timeout (float): Seconds to wait for a free connection
+                before raising TimeoutError.
+            health_check (Callable): Returns False for a broken connection.
+        """
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("expected 0 <= min_size <= max_size, 1 <= max")
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+        self._idle = collections.deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        for _ in range(min_size):
+            self._idle.append((connect(), time.monotonic()))
+            self._size += 1
+
+    @property
+    def size(self) -> int:
+        """number of open connections, idle or checked out"""
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        """number of idle connections"""
+        return len(self._idle)
+
+    def connection(self) -> PooledConnection:
+        """Check out a healthy connection.
+
+        Returns:
+            PooledConnection: The connection, `close` it to give it back.
+
+        Raises:
+            TimeoutError: If no connection was freed in time.
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            connection, create, stale = None, False, []
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                stale = self._evict()
+                if self._idle:
+                    connection = self._idle.pop()[0]
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        raise TimeoutError("no free database connection")
+            self._close_all(stale)
+            if create:
+                try:
+                    return PooledConnection(self, self.connect())
+                except Exception:
+                    self._discard()
+                    raise
+            if connection is not None:
+                if self.health_check(connection):
+                    return PooledConnection(self, connection)
+                self._close_all([connection])
+                self._discard()
+
+    def release(self, connection: Any) -> None:
+        """Give a checked out connection back to the pool.
+
+        Any open transaction is rolled back first.
+        """
+        try:
+            connection.rollback()
+        except Exception:
+            self._close_all([connection])
+            self._discard()
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+                return
+            self._size -= 1
+        self._close_all([connection])
+
+    def evict_idle(self) -> int:
+        """Close the connections idle for longer than `idle_timeout`.
+
+        Returns:
+            int: The number of connections closed.
+        """
+        with self._cond:
+            stale = self._evict()
+        self._close_all(stale)
+        return len(stale)
+
+    def close(self) -> None:
+        """Close the idle connections, the others close when released"""
+        with self._cond:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        self._close_all(idle)
+
+    def _evict(self) -> List[Any]:
+        """pop the stale idle connections, the lock must be held"""
+        stale = []
+        limit = time.monotonic() - self.idle_timeout
+        while self._idle and self._size > self.min_size \
+                and self._idle[0][1] < limit:
+            stale.append(self._idle.popleft()[0])
+            self._size -= 1
+        return stale
+
+    def _discard(self) -> None:
+        """forget a connection that could not be used"""
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_all(connections: List[Any]) -> None:
+        """close connections, ignoring errors"""
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
@@ -2,20 +2,216 @@
 
 """
     User passwords should NEVER be stored in plain text in a database.
+
+    bcrypt releases the GIL while hashing, so the work is run on a bounded
+    pool of threads sized to the machine's cores: concurrent callers use
+    every core without oversubscribing them. Each operation has a blocking
+    and an `async` variant.
+
+    The bcrypt cost is read from the JSON file named by BCRYPT_CONFIG
+    (.bcrypt.json by default). Calibrate it for the host with:
+
+        python3 encrypt_password.py calibrate --target-ms 100
 """
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union
+
+DEFAULT_ROUNDS = 12
+
+
+def config_path() -> str:
+    """
+        returns the path of the bcrypt cost configuration file.
+    """
+    return os.getenv("BCRYPT_CONFIG", ".bcrypt.json")
+
+
+def load_rounds(path: str = None) -> int:
+    """
+        returns the configured bcrypt cost, or bcrypt's default.
+    """
+    try:
+        with open(path or config_path()) as f:
+            return int(json.load(f)["rounds"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return DEFAULT_ROUNDS
+
+
+def save_rounds(rounds: int, path: str = None, **details) -> None:
+    """
+        store the bcrypt cost, with how it was chosen, in the config file.
+    """
+    with open(path or config_path(), "w") as f:
+        json.dump(dict(details, rounds=rounds), f)
+
+
+def hash_rounds(hashed_password: Union[bytes, str]) -> int:
+    """
+        returns the cost factor recorded in a bcrypt hash ($2b$<cost>$...).
+    """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode()
+    try:
+        return int(hashed_password.split(b"$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def calibrate(target_ms: float = 100.0, percentile: float = 99.0,
+              samples: int = 10, min_rounds: int = 4,
+              max_rounds: int = 16) -> int:
+    """
+        returns the highest bcrypt cost whose hashing latency at the given
+        percentile stays under target_ms on this host.
+    """
+    best = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds))
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        index = max(math.ceil(percentile / 100 * samples) - 1, 0)
+        if timings[index] > target_ms:
+            break
+        best = rounds
+    return best
+
+
+def _hashpw(password: str, rounds: int = DEFAULT_ROUNDS) -> bytes:
+    """hash a password with a new salt"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds))
+
+
+def _checkpw(hashed_password: bytes, password: str) -> bool:
+    """check a password against its hash"""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+class HashingService:
+    """
+        Run bcrypt hashing and checking on a bounded pool of worker threads.
+    """
+
+    def __init__(self, max_workers: int = None, rounds: int = None):
+        """
+            max_workers defaults to the number of cores, rounds to the
+            configured bcrypt cost.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.rounds = rounds or load_rounds()
+        self._executor = ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix="bcrypt")
+
+    def needs_rehash(self, hashed_password: Union[bytes, str]) -> bool:
+        """
+            True if the hash was made with another cost than the current one.
+        """
+        return hash_rounds(hashed_password) != self.rounds
+
+    def hash_password(self, password: str) -> bytes:
+        """
+            returns a salted, hashed password, waiting for a free worker.
+        """
+        return self._executor.submit(_hashpw, password, self.rounds).result()
+
+    def is_valid(self, hashed_password: bytes, password: str) -> bool:
+        """
+            validate a password against its hash, waiting for a free worker.
+        """
+        return self._executor.submit(
+            _checkpw, hashed_password, password).result()
+
+    async def hash_password_async(self, password: str) -> bytes:
+        """
+            returns a salted, hashed password without blocking the loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, _hashpw, password, self.rounds)
+
+    async def is_valid_async(self, hashed_password: bytes,
+                             password: str) -> bool:
+        """
+            validate a password against its hash without blocking the loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, _checkpw, hashed_password, password)
+
+    def shutdown(self) -> None:
+        """
+            stop the workers once the pending operations are done.
+        """
+        self._executor.shutdown()
+
+
+hashing_service = HashingService()
 
 
 def hash_password(password: str) -> bytes:
     """
         returns a salted, hashed password, which is a byte string.
     """
-
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    return hashing_service.hash_password(password)
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
     """
         Use bcrypt to validate that password matches the hashed password.
     """
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+    return hashing_service.is_valid(hashed_password, password)
+
+
+async def hash_password_async(password: str) -> bytes:
+    """
+        `hash_password` for coroutines, run on the hashing pool.
+    """
+    return await hashing_service.hash_password_async(password)
+
+
+async def is_valid_async(hashed_password: bytes, password: str) -> bool:
+    """
+        `is_valid` for coroutines, run on the hashing pool.
+    """
+    return await hashing_service.is_valid_async(hashed_password, password)
+
+
+def needs_rehash(hashed_password: Union[bytes, str]) -> bool:
+    """
+        True if the password should be hashed again with the current cost,
+        typically right after a successful login.
+    """
+    return hashing_service.needs_rehash(hashed_password)
+
+
+def main(argv: List[str] = None) -> None:
+    """
+        calibrate the bcrypt cost for this host and store it.
+    """
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    tune = commands.add_parser("calibrate", help="pick the bcrypt cost")
+    tune.add_argument("--target-ms", type=float, default=100.0)
+    tune.add_argument("--percentile", type=float, default=99.0)
+    tune.add_argument("--samples", type=int, default=10)
+    tune.add_argument("--config", default=None)
+    args = parser.parse_args(argv)
+
+    rounds = calibrate(args.target_ms, args.percentile, args.samples)
+    save_rounds(rounds, args.config, target_ms=args.target_ms,
+                percentile=args.percentile)
+    print("bcrypt rounds: {}".format(rounds))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
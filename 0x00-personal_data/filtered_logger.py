@@ -7,44 +7,337 @@ message, a function to create a logger for user data, a function to create a
 connection to a database, and a main function to log information about user
 records in a table.
 
+Running the module with the ``redact`` command streams a log or CSV file
+through the same redaction rules::
+
+    python3 -m filtered_logger redact in.log out.log
+
 Classes:
     RedactingFormatter: Formatter class for redacting PII fields from log
         messages.
+    QueueingHandler: Handler that redacts and writes records on a
+        background thread.
 """
+import io
 import os
 import re
+import csv
+import sys
+import time
+import stdlib_logging  # noqa: F401, must come before logging
 import logging
+import argparse
+import functools
+import threading
+import collections
 import mysql.connector
-from typing import List
+from connection_pool import ConnectionPool, PooledConnection
+from concurrent.futures import ProcessPoolExecutor
+from typing import (Iterable, Iterator, List, Mapping, Sequence, Tuple,
+                    Union)
+
 
+BytesLike = Union[bytes, bytearray, memoryview]
 
 PII_FIELDS = ("name", "email", "phone", "ssn", "password")
+USER_COLUMNS = PII_FIELDS + ("last_login", "user_agent")
 
 
 class RedactingFormatter(logging.Formatter):
     """ Redacting Formatter class
-        """
+
+    Structured records are also redacted by key:
+
+    - a mapping passed as the logging argument, as in
+      ``logger.info("email=%(email)s;", {"email": email})``, has its PII
+      values replaced before the message is rendered;
+    - a mapping passed as ``extra={"payload": {...}}`` is rendered as
+      `key=value;` pairs with its PII values replaced, after the message.
+
+    Free-text messages go through the redaction engine. Structured ones
+    skip it when key redaction provably leaves no `field=value` pair
+    behind: every "=" of the template must come from a `field=%(key)s`
+    whose key is a PII one, or follow a non-PII placeholder only past a
+    separator, and no non-PII value or payload key may hold an "=" or end
+    in a field name (see `_plain_template`). Otherwise, as with a PII key
+    used under another placeholder name or written literally in the
+    template, the rendered text is scanned too.
+    """
 
     REDACTION = "***"
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
+    PAYLOAD = "payload"
+    PLACEHOLDER = re.compile(r"%\((?P<key>[^)]*)\)s")
+    CACHE_SIZE = 1024
 
-    def __init__(self, fields: List[str]):
-        """create a new instance"""
+    def __init__(self, fields: List[str], matcher: str = "regex"):
+        """create a new instance, matcher picks the redaction engine"""
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self._field_set = frozenset(fields)
+        self._engine = get_engine(fields, self.REDACTION, self.SEPARATOR,
+                                  matcher)
+        self._plain_templates = {}
+        self._plain_keys = {}
 
     def format(self, record: logging.LogRecord) -> str:
         """format a log"""
-        filtered = filter_datum(self.fields, self.REDACTION,
-                                record.getMessage(), self.SEPARATOR)
-        record.msg = filtered
+        if record.args and isinstance(record.args, Mapping):
+            args = self._redact_mapping(record.args)
+            message = record.msg % args
+            if not (self._plain_template(record.msg)
+                    and self._plain_values(args)):
+                message = self._engine.redact(message)
+        else:
+            message = self._engine.redact(record.getMessage())
+        payload = getattr(record, self.PAYLOAD, None)
+        if isinstance(payload, Mapping):
+            payload = self._redact_mapping(payload)
+            flat = "".join("{}={}{}".format(key, value, self.SEPARATOR)
+                           for key, value in payload.items())
+            if not (all(map(self._plain_key, payload))
+                    and self._plain_values(payload)):
+                flat = self._engine.redact(flat)
+            message = "{} {}".format(message, flat) if message else flat
+        record.msg = message
+        record.args = None
         return super().format(record)
 
+    def _plain_template(self, template: str) -> bool:
+        """whether a template rendered with key-redacted values free of "="
+        cannot hold a `field=value` pair, cached per template"""
+        if not isinstance(template, str):
+            return False
+        plain = self._plain_templates.get(template)
+        if plain is not None:
+            return plain
+        pieces = self.PLACEHOLDER.split(template)
+        literals, keys = pieces[0::2], pieces[1::2]
+        plain = "%" not in "".join(literals).replace("%%", "")
+        skeleton = literals[0]
+        for key, literal in zip(keys, literals[1:]):
+            if key in self._field_set:
+                skeleton += self.REDACTION
+            else:
+                skeleton += "x" if self.SEPARATOR != "x" else "y"
+                if "=" in literal.split(self.SEPARATOR, 1)[0]:
+                    plain = False
+            skeleton += literal
+        skeleton = skeleton.replace("%%", "%")
+        plain = plain and self._engine.redact(skeleton) == skeleton
+        if len(self._plain_templates) >= self.CACHE_SIZE:
+            self._plain_templates.clear()
+        self._plain_templates[template] = plain
+        return plain
+
+    def _plain_key(self, key) -> bool:
+        """whether `key=` rendered for a payload key cannot start a
+        `field=value` pair, or its value is redacted anyway"""
+        plain = self._plain_keys.get(key)
+        if plain is None:
+            pair = "{}=".format(key)
+            plain = key in self._field_set or \
+                self._engine.redact(pair) == pair
+            if len(self._plain_keys) >= self.CACHE_SIZE:
+                self._plain_keys.clear()
+            self._plain_keys[key] = plain
+        return plain
+
+    def _plain_values(self, data: Mapping) -> bool:
+        """whether no value of a key-redacted mapping holds an "=" """
+        for value in data.values():
+            if "=" in (value if type(value) is str else str(value)):
+                return False
+        return True
+
+    def _redact_mapping(self, data: Mapping) -> dict:
+        """copy of data with the values of PII keys replaced"""
+        fields, redaction = self._field_set, self.REDACTION
+        return {key: redaction if key in fields else value
+                for key, value in data.items()}
+
+
+class RedactionEngine:
+    """Precompiled redaction of `field=value` pairs.
+
+    The pattern for a (fields, redaction, separator) combination is compiled
+    once, so redacting a message costs a single pass of the regex over it.
+    """
+
+    def __init__(self, fields: Sequence[str], redaction: str, separator: str):
+        """compile the pattern for the given fields and separator"""
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self.pattern = re.compile(r'(?P<field>{})=[^{}]*'.format(
+            '|'.join(map(re.escape, self.fields)), re.escape(separator)))
+        self.replacement = r'\g<field>={}'.format(redaction)
+
+    def redact(self, message: str) -> str:
+        """return the message with every field value replaced"""
+        return self.pattern.sub(self.replacement, message)
+
+    @functools.cached_property
+    def bytes_pattern(self) -> re.Pattern:
+        """the pattern compiled for UTF-8 encoded messages
+
+        A value stops at the first separator character, as in `pattern`:
+        a non-ASCII separator is several bytes, so it is looked for as a
+        whole rather than as a class of its bytes.
+        """
+        fields = b"|".join(re.escape(field.encode("utf-8"))
+                           for field in self.fields)
+        separators = [char.encode("utf-8")
+                      for char in dict.fromkeys(self.separator)]
+        if all(len(char) == 1 for char in separators):
+            value = b"[^" + re.escape(b"".join(separators)) + b"]*"
+        else:
+            value = b"(?:(?!" + b"|".join(map(re.escape, separators)) \
+                + b").)*"
+        return re.compile(b"(?P<field>" + fields + b")=" + value, re.DOTALL)
+
+    def redact_bytes(self, data: BytesLike,
+                     out: BytesLike = None) -> Union[bytes, int]:
+        """Redact a bytes-like message without decoding it.
+
+        Args:
+            data (BytesLike): The UTF-8 message, read through a memoryview.
+            out (BytesLike): Optional writable buffer receiving the result;
+                it must not overlap `data`.
+
+        Returns:
+            Union[bytes, int]: The redacted message, or the number of bytes
+            written when `out` is given.
+
+        Raises:
+            ValueError: If the result does not fit in `out`.
+        """
+        src = memoryview(data).cast("B")
+        redaction = self.redaction.encode("utf-8")
+        pieces, pos = [], 0
+        for match in self.bytes_pattern.finditer(src):
+            value = match.end("field") + 1
+            pieces.append(src[pos:value])
+            pieces.append(redaction)
+            pos = match.end()
+        pieces.append(src[pos:])
+        if out is None:
+            return b"".join(pieces)
+        dst = memoryview(out).cast("B")
+        size = sum(map(len, pieces))
+        if size > len(dst):
+            raise ValueError("output buffer too small: {} < {}".format(
+                len(dst), size))
+        written = 0
+        for piece in pieces:
+            dst[written:written + len(piece)] = piece
+            written += len(piece)
+        return written
+
+
+class TrieRedactionEngine:
+    """Redaction of `field=value` pairs with a trie of the field names.
+
+    Every field match ends right before an "=", so the engine jumps from one
+    "=" to the next with `str.find` and walks a trie of the reversed field
+    names backwards from there. The cost of a message depends on its length
+    and on the longest field name, not on the number of fields, which makes
+    it the better choice for large field sets. The output is the same as
+    `RedactionEngine`'s; field names must not contain "=".
+    """
+
+    _END = None
+
+    def __init__(self, fields: Sequence[str], redaction: str, separator: str):
+        """build the trie of the reversed field names"""
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self._trie = {}
+        for field in self.fields:
+            if "=" in field or not field:
+                raise ValueError("invalid field name: {!r}".format(field))
+            node = self._trie
+            for char in reversed(field):
+                node = node.setdefault(char, {})
+            node[self._END] = True
+        if len(separator) == 1:
+            self._value_end = functools.partial(self._find, separator)
+        else:
+            self._value_end = functools.partial(self._search, re.compile(
+                "[{}]".format(re.escape(separator))))
+
+    @staticmethod
+    def _find(separator: str, message: str, start: int) -> int:
+        """index of the separator ending the value starting at start"""
+        end = message.find(separator, start)
+        return len(message) if end == -1 else end
+
+    @staticmethod
+    def _search(pattern: re.Pattern, message: str, start: int) -> int:
+        """index of any separator char ending the value starting at start"""
+        match = pattern.search(message, start)
+        return len(message) if match is None else match.start()
+
+    def redact(self, message: str) -> str:
+        """return the message with every field value replaced"""
+        trie, end_key, find = self._trie, self._END, message.find
+        parts, pos = [], 0
+        equal = find("=")
+        while equal != -1:
+            node, i = trie, equal - 1
+            while i >= pos:
+                node = node.get(message[i])
+                if node is None or end_key in node:
+                    break
+                i -= 1
+            if node is not None and i >= pos:
+                parts.append(message[pos:equal + 1])
+                parts.append(self.redaction)
+                pos = self._value_end(message, equal + 1)
+                equal = find("=", pos)
+            else:
+                equal = find("=", equal + 1)
+        if not parts:
+            return message
+        parts.append(message[pos:])
+        return "".join(parts)
+
+
+ENGINES = {
+    "regex": RedactionEngine,
+    "trie": TrieRedactionEngine,
+}
+
+
+@functools.lru_cache(maxsize=128)
+def _cached_engine(fields: tuple, redaction: str, separator: str,
+                   matcher: str) -> RedactionEngine:
+    """build and memoize the engine for one combination"""
+    return ENGINES[matcher](fields, redaction, separator)
+
+
+def get_engine(fields: Sequence[str], redaction: str, separator: str,
+               matcher: str = "regex") -> RedactionEngine:
+    """Return the shared engine for a combination of redaction rules.
+
+    Engines are kept in a bounded LRU cache keyed by the fields, the
+    redaction string, the separator and the matcher.
+
+    Args:
+        matcher (str): "regex" for an alternation of the fields, or "trie"
+            for large field sets, see `TrieRedactionEngine`.
+    """
+    if matcher not in ENGINES:
+        raise ValueError("matcher must be one of {}".format(
+            ", ".join(ENGINES)))
+    return _cached_engine(tuple(fields), redaction, separator, matcher)
+
 
 def filter_datum(
         fields: List[str], redaction: str,
-        message: str, separator: str
+        message: str, separator: str, matcher: str = "regex"
 ) -> str:
     """Filter a log message.
 
@@ -53,24 +346,403 @@ def filter_datum(
         redaction (str): The redaction string to use for the filtered fields.
         message (str): The log message to filter.
         separator (str): The separator character to use for the PII fields.
+        matcher (str): The engine matching the fields, "regex" or "trie".
 
     Returns:
         str: The filtered log message.
     """
-    extract, replace = (
-        lambda x, y: r'(?P<field>{})=[^{}]*'.format('|'.join(x), y),
-        lambda x: r'\g<field>={}'.format(x))
-    return re.sub(extract(fields, separator), replace(redaction), message)
+    return get_engine(fields, redaction, separator, matcher).redact(message)
+
+
+def filter_datum_bytes(
+        fields: List[str], redaction: str,
+        data: BytesLike, separator: str, out: BytesLike = None
+) -> Union[bytes, int]:
+    """Filter a raw UTF-8 log message without decoding it.
+
+    Same rules as `filter_datum`, for bytes, bytearray or memoryview
+    messages. Unchanged spans are sliced from a memoryview of `data`, so
+    with `out` the only copy made is the write into the caller's buffer.
+
+    Args:
+        fields (List[str]): A list of PII fields to filter.
+        redaction (str): The redaction string to use for the filtered fields.
+        data (BytesLike): The log message to filter.
+        separator (str): The separator character to use for the PII fields.
+        out (BytesLike): Optional writable buffer receiving the result.
+
+    Returns:
+        Union[bytes, int]: The filtered log message, or the number of bytes
+        written to `out`.
+    """
+    return get_engine(fields, redaction, separator).redact_bytes(data, out)
+
+
+def _redact_line(redact, line: str) -> str:
+    """redact a line without letting a value swallow its line ending"""
+    body = line.rstrip("\r\n")
+    if len(body) == len(line):
+        return redact(line)
+    return redact(body) + line[len(body):]
+
+
+def redact_lines(
+        lines: Iterable[str], fields: Sequence[str] = PII_FIELDS,
+        redaction: str = RedactingFormatter.REDACTION,
+        separator: str = RedactingFormatter.SEPARATOR
+) -> Iterator[str]:
+    """Lazily redact `field=value` pairs in a stream of log lines.
+
+    Args:
+        lines (Iterable[str]): The lines to redact, e.g. an open file.
+        fields (Sequence[str]): The PII fields to filter.
+        redaction (str): The redaction string to use for the filtered fields.
+        separator (str): The separator character to use for the PII fields.
+
+    Yields:
+        str: Each line with its PII values redacted, line ending kept.
+    """
+    redact = get_engine(fields, redaction, separator).redact
+    for line in lines:
+        yield _redact_line(redact, line)
+
+
+def redact_rows(
+        rows: Iterable[List[str]], fields: Sequence[str] = PII_FIELDS,
+        redaction: str = RedactingFormatter.REDACTION
+) -> Iterator[List[str]]:
+    """Lazily redact the PII columns of CSV rows.
+
+    The first row is the header; columns whose name is one of `fields` have
+    their values replaced in every following row.
+
+    Args:
+        rows (Iterable[List[str]]): The parsed CSV rows, header first.
+        fields (Sequence[str]): The PII fields to filter.
+        redaction (str): The redaction string to use for the filtered fields.
+
+    Yields:
+        List[str]: The header, then each row with its PII columns redacted.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    yield header
+    pii = [i for i, column in enumerate(header) if column in fields]
+    for row in rows:
+        for i in pii:
+            if i < len(row):
+                row[i] = redaction
+        yield row
+
+
+def redact_file(
+        src: str, dst: str, fields: Sequence[str] = PII_FIELDS,
+        separator: str = RedactingFormatter.SEPARATOR,
+        file_format: str = "auto", buffer_size: int = 1 << 20
+) -> dict:
+    """Redact a log or CSV file into another file in constant memory.
+
+    Args:
+        src (str): Path of the file to read.
+        dst (str): Path of the redacted file to write.
+        fields (Sequence[str]): The PII fields to filter.
+        separator (str): The separator character of log lines.
+        file_format (str): "log", "csv" or "auto" to pick from the extension.
+        buffer_size (int): Size in bytes of the read and write buffers.
+
+    Returns:
+        dict: The number of lines and bytes read, and the elapsed seconds.
+    """
+    if file_format == "auto":
+        file_format = "csv" if src.lower().endswith(".csv") else "log"
+    redaction = RedactingFormatter.REDACTION
+    lines = 0
+
+    def counted(stream):
+        nonlocal lines
+        for lines, line in enumerate(stream, 1):
+            yield line
+
+    start = time.perf_counter()
+    with open(src, "r", buffering=buffer_size, newline="",
+              encoding="utf-8", errors="surrogateescape") as f_in, \
+            open(dst, "w", buffering=buffer_size, newline="",
+                 encoding="utf-8", errors="surrogateescape") as f_out:
+        if file_format == "csv":
+            csv.writer(f_out, lineterminator="\n").writerows(
+                redact_rows(csv.reader(counted(f_in)), fields, redaction))
+        else:
+            f_out.writelines(
+                redact_lines(counted(f_in), fields, redaction, separator))
+    return {
+        "lines": lines,
+        "bytes": os.path.getsize(src),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def split_ranges(path: str, chunk_size: int) -> List[Tuple[int, int]]:
+    """Split a file into byte ranges that end on a line boundary.
+
+    Args:
+        path (str): Path of the file to split.
+        chunk_size (int): Approximate size in bytes of each range.
+
+    Returns:
+        List[Tuple[int, int]]: The (start, end) offsets of each range.
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _redact_range(
+        path: str, start: int, end: int, fields: Tuple[str, ...],
+        redaction: str, separator: str
+) -> Tuple[bytes, int]:
+    """Redact one byte range of a log file in a worker process.
+
+    The engine comes from the per-process cache, so each worker compiles
+    the pattern once for the whole run.
+    """
+    redact = get_engine(fields, redaction, separator).redact
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8", "surrogateescape")
+    # split like the newline="" files of redact_file: only on \n, \r and
+    # \r\n, not on the other separators str.splitlines knows
+    lines = list(io.StringIO(text, newline=""))
+    redacted = "".join([_redact_line(redact, line) for line in lines])
+    if sum(1 for _ in io.StringIO(redacted, newline="")) != len(lines):
+        raise ValueError("redaction changed the line count of {} [{}:{}]"
+                         .format(path, start, end))
+    return redacted.encode("utf-8", "surrogateescape"), len(lines)
+
+
+def redact_file_parallel(
+        src: str, dst: str, fields: Sequence[str] = PII_FIELDS,
+        separator: str = RedactingFormatter.SEPARATOR,
+        workers: int = None, chunk_size: int = 8 << 20
+) -> dict:
+    """Redact a log file using a pool of worker processes.
+
+    The file is split into newline aligned byte ranges that are redacted
+    in parallel and written back in their original order. At most two
+    ranges per worker are in flight, which bounds memory use.
+
+    Args:
+        src (str): Path of the log file to read.
+        dst (str): Path of the redacted file to write.
+        fields (Sequence[str]): The PII fields to filter.
+        separator (str): The separator character of log lines.
+        workers (int): Number of processes, defaults to the CPU count.
+        chunk_size (int): Approximate size in bytes of each range.
+
+    Returns:
+        dict: The number of lines and bytes read, and the elapsed seconds.
+    """
+    workers = workers or os.cpu_count() or 1
+    redaction = RedactingFormatter.REDACTION
+    fields = tuple(fields)
+    lines = 0
+    start = time.perf_counter()
+    ranges = split_ranges(src, chunk_size)
+    with ProcessPoolExecutor(workers) as pool, open(dst, "wb") as f_out:
+        pending = collections.deque()
+        for begin, end in ranges:
+            pending.append(pool.submit(_redact_range, src, begin, end,
+                                       fields, redaction, separator))
+            if len(pending) >= 2 * workers:
+                chunk, count = pending.popleft().result()
+                f_out.write(chunk)
+                lines += count
+        while pending:
+            chunk, count = pending.popleft().result()
+            f_out.write(chunk)
+            lines += count
+    return {
+        "lines": lines,
+        "bytes": os.path.getsize(src),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def report(stats: dict, stream=sys.stderr) -> None:
+    """Print the throughput of a redaction run.
 
+    Args:
+        stats (dict): The statistics returned by `redact_file`.
+        stream: Where to write the report.
+    """
+    seconds = max(stats["seconds"], 1e-9)
+    megabytes = stats["bytes"] / (1 << 20)
+    print("{} lines, {:.1f} MB in {:.2f}s: {:.0f} lines/sec, {:.1f} MB/sec"
+          .format(stats["lines"], megabytes, stats["seconds"],
+                  stats["lines"] / seconds, megabytes / seconds),
+          file=stream)
 
-def get_logger() -> logging.Logger:
+
+class QueueingHandler(logging.Handler):
+    """Handler that formats and writes records on a background thread.
+
+    `emit` only appends the record to a bounded in-memory queue; a writer
+    thread formats (and so redacts) queued records and writes them to the
+    stream in batches. When the queue is full the `overflow` policy applies:
+
+    - "block": the caller waits until the writer frees a slot.
+    - "drop_oldest": the oldest queued record is discarded.
+    - "sample": one overflowing record in `sample_every` replaces the
+      oldest queued record, the others are discarded.
+
+    Discarded records are counted in `dropped`.
+    """
+
+    terminator = "\n"
+    OVERFLOW_POLICIES = ("block", "drop_oldest", "sample")
+
+    def __init__(self, stream=None, capacity: int = 10000,
+                 overflow: str = "block", batch_size: int = 512,
+                 sample_every: int = 10):
+        """create the handler and start its writer thread"""
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(
+                ", ".join(self.OVERFLOW_POLICIES)))
+        super().__init__()
+        self.stream = stream if stream is not None else sys.stderr
+        self.capacity = capacity
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.sample_every = sample_every
+        self.dropped = 0
+        self._overflowed = 0
+        self._pending = 0
+        self._closed = False
+        self._queue = collections.deque()
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        self._idle = threading.Condition(self._mutex)
+        self._writer = threading.Thread(target=self._run, daemon=True,
+                                        name="QueueingHandler-writer")
+        self._writer.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """queue a record for the writer thread"""
+        with self._mutex:
+            self._enqueue(record)
+            self._not_empty.notify()
+
+    def emit_batch(self, records: List[logging.LogRecord]) -> None:
+        """queue several records while taking the lock once"""
+        records = [record for record in records
+                   if record.levelno >= self.level and self.filter(record)]
+        with self._mutex:
+            for record in records:
+                self._enqueue(record)
+            self._not_empty.notify()
+
+    def _enqueue(self, record: logging.LogRecord) -> None:
+        """append a record, the lock must be held"""
+        if self._closed:
+            return
+        if len(self._queue) >= self.capacity and not self._make_room():
+            return
+        self._queue.append(record)
+        self._pending += 1
+
+    def _make_room(self) -> bool:
+        """apply the overflow policy, return False to discard the record"""
+        if self.overflow == "block":
+            while len(self._queue) >= self.capacity and not self._closed:
+                self._not_full.wait()
+            return not self._closed
+        if self.overflow == "sample":
+            self._overflowed += 1
+            if self._overflowed % self.sample_every:
+                self.dropped += 1
+                return False
+        self._queue.popleft()
+        self._pending -= 1
+        self.dropped += 1
+        return True
+
+    def _run(self) -> None:
+        """writer loop: format and write queued records in batches"""
+        while True:
+            with self._mutex:
+                while not self._queue and not self._closed:
+                    self._not_empty.wait()
+                if not self._queue:
+                    return
+                size = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for _ in range(size)]
+                self._not_full.notify_all()
+            self._write(batch)
+            with self._mutex:
+                self._pending -= size
+                if not self._pending:
+                    self._idle.notify_all()
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        """format a batch of records and write it in one call"""
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        try:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+        except Exception:
+            self.handleError(batch[-1])
+
+    def flush(self) -> None:
+        """wait until every queued record has been written"""
+        with self._mutex:
+            while self._pending and self._writer.is_alive():
+                self._idle.wait(0.1)
+
+    def close(self) -> None:
+        """write the remaining records and stop the writer thread"""
+        with self._mutex:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._writer is not threading.current_thread():
+            self._writer.join()
+        super().close()
+
+
+def get_logger(queued: bool = False, capacity: int = 10000,
+               overflow: str = "block") -> logging.Logger:
     """Create a logger for user data.
 
+    Args:
+        queued (bool): Redact and write records on a background thread
+            through a `QueueingHandler` instead of on the caller's thread.
+        capacity (int): Size of the queue when `queued` is set.
+        overflow (str): What to do when the queue is full, one of
+            `QueueingHandler.OVERFLOW_POLICIES`.
+
     Returns:
         logging.Logger: The logger object.
     """
     logger = logging.getLogger("user_data")
-    stream_handler = logging.StreamHandler()
+    if queued:
+        stream_handler = QueueingHandler(capacity=capacity, overflow=overflow)
+    else:
+        stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(RedactingFormatter(PII_FIELDS))
     logger.setLevel(logging.INFO)
     logger.propagate = False
@@ -78,7 +750,7 @@ def get_logger() -> logging.Logger:
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
+def _connect() -> mysql.connector.connection.MySQLConnection:
     """Create a connection to a database.
 
     Returns:
@@ -94,18 +766,160 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     )
 
 
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the connection pool behind `get_db`, creating it on first use.
+
+    Its bounds come from PERSONAL_DATA_DB_POOL_MIN, PERSONAL_DATA_DB_POOL_MAX
+    and PERSONAL_DATA_DB_POOL_IDLE (seconds before an idle connection is
+    closed).
+
+    Returns:
+        ConnectionPool: The shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                _connect,
+                min_size=int(os.getenv("PERSONAL_DATA_DB_POOL_MIN", "1")),
+                max_size=int(os.getenv("PERSONAL_DATA_DB_POOL_MAX", "5")),
+                idle_timeout=float(
+                    os.getenv("PERSONAL_DATA_DB_POOL_IDLE", "300")))
+        return _pool
+
+
+def get_db() -> PooledConnection:
+    """Check out a connection to the database from the shared pool.
+
+    The connection behaves like a mysql.connector connection; closing it
+    gives it back to the pool.
+
+    Returns:
+        PooledConnection: The database connection object.
+    """
+    return get_pool().connection()
+
+
+def format_rows(rows: Iterable[Sequence], columns: Sequence[str]
+                = USER_COLUMNS) -> List[str]:
+    """Render rows as `key=value;` log messages in one pass.
+
+    Args:
+        rows (Iterable[Sequence]): The rows, with values in `columns` order.
+        columns (Sequence[str]): The column names.
+
+    Returns:
+        List[str]: One message per row.
+    """
+    template = "".join("{}={{}};".format(column) for column in columns)
+    return [template.format(*row) for row in rows]
+
+
+def log_batch(logger: logging.Logger, messages: List[str],
+              level: int = logging.INFO) -> None:
+    """Log several messages, handing them to each handler as one batch.
+
+    Handlers with an `emit_batch` method (like `QueueingHandler`) receive
+    the whole batch at once, other handlers get the records one by one.
+
+    Args:
+        logger (logging.Logger): The logger to log to.
+        messages (List[str]): The messages to log.
+        level (int): The level of the records.
+    """
+    if not messages or not logger.isEnabledFor(level):
+        return
+    records = [logger.makeRecord(logger.name, level, __file__, 0,
+                                 message, None, None)
+               for message in messages]
+    records = [record for record in records if logger.filter(record)]
+    for handler in logger.handlers:
+        emit_batch = getattr(handler, "emit_batch", None)
+        if emit_batch is not None:
+            emit_batch(records)
+        else:
+            for record in records:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+def export_users(db, logger: logging.Logger,
+                 batch_size: int = 1000) -> dict:
+    """Log every row of the users table through the redacting logger.
+
+    Rows are pulled with `fetchmany` so that only one batch is held in
+    memory at a time, whatever the size of the table.
+
+    Args:
+        db: A DB-API connection to the database holding the users table.
+        logger (logging.Logger): The logger to log the rows to.
+        batch_size (int): Number of rows fetched and logged at once.
+
+    Returns:
+        dict: The number of rows logged and the elapsed seconds.
+    """
+    start = time.perf_counter()
+    count = 0
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT {} FROM users;".format(", ".join(USER_COLUMNS)))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            log_batch(logger, format_rows(rows))
+            count += len(rows)
+    finally:
+        cursor.close()
+    return {"rows": count, "seconds": time.perf_counter() - start}
+
+
 def main():
     """Entry Point Log information"""
     db = get_db()
-    cursor = db.cursor()
-    cursor.execute(
-        "SELECT name, email, phone, ssn, password, last_login,\
-        user_agent FROM users;")
-    logger = get_logger()
-    for row in cursor:
-        logger.info("name={};email={};phone={};ssn={};password={};\
-                    last_login={};user_agent={};".
-                    format(row[0], row[1], row[2], row[3], row[4],
-                           row[5], row[6]))
-    cursor.close()
+    batch_size = int(os.getenv("PERSONAL_DATA_BATCH_SIZE", "1000"))
+    export_users(db, get_logger(), batch_size)
     db.close()
+
+
+def cli(argv: List[str] = None) -> None:
+    """Command line entry point.
+
+    Without a command, logs the users table like `main`. The ``redact``
+    command streams a file through the redaction rules and reports its
+    throughput on stderr; log files can be split across ``--workers``
+    processes.
+    """
+    parser = argparse.ArgumentParser(prog="filtered_logger")
+    commands = parser.add_subparsers(dest="command")
+    redact = commands.add_parser("redact", help="redact a log or CSV file")
+    redact.add_argument("src", help="file to read")
+    redact.add_argument("dst", help="file to write")
+    redact.add_argument("--format", dest="file_format", default="auto",
+                        choices=("auto", "log", "csv"))
+    redact.add_argument("--fields", default=",".join(PII_FIELDS),
+                        help="comma separated PII fields")
+    redact.add_argument("--separator", default=RedactingFormatter.SEPARATOR)
+    redact.add_argument("--workers", type=int, default=1,
+                        help="processes for log files, 0 for all cores")
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        return main()
+    fields = args.fields.split(",")
+    is_csv = args.file_format == "csv" or (
+        args.file_format == "auto" and args.src.lower().endswith(".csv"))
+    if args.workers != 1 and not is_csv:
+        report(redact_file_parallel(args.src, args.dst, fields,
+                                    args.separator, args.workers or None))
+    else:
+        report(redact_file(args.src, args.dst, fields,
+                           args.separator, args.file_format))
+
+
+if __name__ == "__main__":
+    cli()
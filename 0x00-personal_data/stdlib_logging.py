@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""Import the standard library logging module ahead of ./logging.py.
+
+This directory has a logging.py script of its own, which shadows the
+standard library module whenever the directory comes first in sys.path,
+as it does for ``python3 -m filtered_logger`` or ``python3 benchmark.py``
+run from here. Importing this module first loads the standard library
+module into sys.modules, so later ``import logging`` statements get it.
+"""
+import os
+import sys
+
+if "logging" not in sys.modules:
+    _path = sys.path
+    _here = os.path.dirname(os.path.abspath(__file__))
+    sys.path = [entry for entry in _path
+                if os.path.abspath(entry or os.curdir) != _here]
+    try:
+        import logging  # noqa: F401
+    finally:
+        sys.path = _path
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+    Coalescing of concurrent identical credential checks.
+"""
+import os
+import hmac
+import hashlib
+import threading
+from typing import Any, Callable, Dict
+
+
+class _Call:
+    """one computation in flight and the threads waiting for it"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+        Run a function once for all the concurrent callers of the same key.
+
+        The first caller of a key computes the result; callers arriving
+        while it runs wait for it and get the same result (or exception).
+        `calls` counts every call and `coalesced` those that waited instead
+        of computing.
+    """
+    def __init__(self):
+        """create an empty group"""
+        self._key = os.urandom(32)
+        self._lock = threading.Lock()
+        self._calls: Dict[bytes, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def key(self, *parts: str) -> bytes:
+        """
+            keyed HMAC of the parts, so secrets are not kept as keys.
+        """
+        message = "\0".join(str(part) for part in parts).encode('utf-8')
+        return hmac.new(self._key, message, hashlib.sha256).digest()
+
+    def do(self, key: bytes, function: Callable, *args) -> Any:
+        """
+            returns function(*args), shared with concurrent calls of key.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        """
+            number of calls, of coalesced calls and of keys in flight.
+        """
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced,
+                    "in_flight": len(self._calls)}
@@ -2,17 +2,25 @@
 
 """Create the class BasicAuth that inherits from Auth"""
 
+import os
 import base64
 import binascii
-from typing import TypeVar
+from typing import Tuple, TypeVar
 from api.v1.auth.auth import Auth
 from api.v1.auth.auth import Auth
+from api.v1.auth.credential_cache import CredentialCache
+from api.v1.auth.single_flight import SingleFlight
 from models.base import Base
 from models.user import User
 
 
 class BasicAuth(Auth):
     """Create a class BasicAuth that inherits from Auth"""
+    credential_cache = CredentialCache(
+        max_size=int(os.getenv('BASIC_AUTH_CACHE_SIZE', '1024')),
+        ttl=float(os.getenv('BASIC_AUTH_CACHE_TTL', '300')))
+    credential_flight = SingleFlight()
+
     def extract_base64_authorization_header(
         self,
         authorization_header: str
@@ -72,22 +80,59 @@ class BasicAuth(Auth):
         """
             returns the User instance based on his email and password.
         """
+        return self._check_credentials(user_email, user_pwd)[0]
+
+    def _check_credentials(
+        self,
+        user_email: str,
+        user_pwd: str
+    ) -> Tuple[TypeVar('User'), int]:
+        """
+            returns the User matching the credentials, or None, with the
+            credential_cache ticket taken before checking them.
+            Concurrent checks of the same credentials share one lookup and
+            password verification.
+        """
         if isinstance(user_email, str) and isinstance(user_pwd, str):
-            try:
-                users = User.search({'email': user_email})
-            except Exception:
-                return None
-            if len(users) <= 0:
-                return None
-            if users[0].is_valid_password(user_pwd):
-                return users[0]
-        return None
+            key = self.credential_flight.key(user_email, user_pwd)
+            return self.credential_flight.do(
+                key, self._verify_credentials, user_email, user_pwd)
+        return None, None
+
+    def _verify_credentials(
+        self,
+        user_email: str,
+        user_pwd: str
+    ) -> Tuple[TypeVar('User'), int]:
+        """
+            looks the user up by email and checks the password.
+        """
+        ticket = self.credential_cache.ticket()
+        try:
+            users = User.search({'email': user_email})
+        except Exception:
+            return None, ticket
+        if len(users) <= 0:
+            return None, ticket
+        if users[0].is_valid_password(user_pwd):
+            return users[0], ticket
+        return None, ticket
 
     def current_user(self, request=None) -> TypeVar('User'):
         """
             overloads Auth and retrieves the User instance for a request:
+            a header verified recently is served from credential_cache.
+            The cache is looked up again after User.get, which catches up
+            with the changes of other processes and so may invalidate it.
         """
         auth_header = self.authorization_header(request)
+        if auth_header is not None:
+            user_id = self.credential_cache.get(auth_header)
+            if user_id is not None:
+                user = User.get(user_id)
+                if user is not None and \
+                        self.credential_cache.get(auth_header) == user_id:
+                    return user
         base64_auth_token = self.extract_base64_authorization_header(
             auth_header)
         decode_auth_token = self.decode_base64_authorization_header(
@@ -95,6 +140,10 @@ class BasicAuth(Auth):
         user_credentials = self.extract_user_credentials(
             decode_auth_token)
         email, password = user_credentials
-        user_obj = self.user_object_from_credentials(
-            email, password)
+        user_obj, ticket = self._check_credentials(email, password)
+        if user_obj is not None:
+            self.credential_cache.put(auth_header, user_obj.id, ticket)
         return user_obj
+
+
+User.add_listener(BasicAuth.credential_cache.on_user_change)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""
+    Cache of verified Basic Authorization headers.
+"""
+import os
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Set
+
+
+class CredentialCache:
+    """
+        Bounded LRU cache mapping a verified Authorization header to the id
+        of its user, for `ttl` seconds.
+
+        Headers are never stored: entries are keyed by an HMAC of the header
+        under a random per-process key.
+
+        A password check takes a `ticket` before it starts and passes it to
+        `put`, which refuses the entry if the user was invalidated since:
+        a password changed during a slow check is never cached. The last
+        invalidation of each user is kept in a fixed table of `slots`
+        generations, indexed by a hash of the user id; users sharing a
+        slot only lose some caching.
+    """
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0,
+                 slots: int = 4096):
+        """
+            max_size is the number of headers kept, ttl their lifetime.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._by_user: Dict[str, Set[bytes]] = {}
+        self._generation = 0
+        self._invalidated: List[int] = [0] * slots
+        self._lock = threading.Lock()
+
+    def _digest(self, authorization_header: str) -> bytes:
+        """
+            keyed HMAC of the raw header.
+        """
+        return hmac.new(self._key, authorization_header.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def get(self, authorization_header: str) -> str:
+        """
+            returns the user id verified for this header, or None.
+        """
+        digest = self._digest(authorization_header)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            user_id, expires = entry
+            if expires < time.monotonic():
+                self._drop(digest)
+                return None
+            self._entries.move_to_end(digest)
+            return user_id
+
+    def ticket(self) -> int:
+        """
+            returns the generation to pass to `put` for a check starting now.
+        """
+        with self._lock:
+            return self._generation
+
+    def _slot(self, user_id: str) -> int:
+        """
+            index of user_id in the table of invalidations.
+        """
+        return hash(user_id) % len(self._invalidated)
+
+    def put(self, authorization_header: str, user_id: str,
+            ticket: int = None) -> None:
+        """
+            remember that this header authenticates user_id, unless the
+            user was invalidated after `ticket` was taken.
+        """
+        digest = self._digest(authorization_header)
+        with self._lock:
+            if ticket is not None and \
+                    self._invalidated[self._slot(user_id)] > ticket:
+                return
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = (user_id, time.monotonic() + self.ttl)
+            self._by_user.setdefault(user_id, set()).add(digest)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str) -> None:
+        """
+            forget every header of a user.
+        """
+        with self._lock:
+            self._generation += 1
+            self._invalidated[self._slot(user_id)] = self._generation
+            for digest in self._by_user.pop(user_id, ()):
+                self._entries.pop(digest, None)
+
+    def on_user_change(self, event: str, user) -> None:
+        """
+            listener for User.save and User.remove: a saved user may have a
+            new password and a removed one must not authenticate anymore.
+        """
+        self.invalidate_user(user.id)
+
+    def clear(self) -> None:
+        """
+            forget every header.
+        """
+        with self._lock:
+            self._generation += 1
+            self._invalidated = [self._generation] * len(self._invalidated)
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self) -> int:
+        """
+            number of cached headers.
+        """
+        return len(self._entries)
+
+    def _drop(self, digest: bytes) -> None:
+        """
+            remove one entry, the lock must be held.
+        """
+        user_id, _ = self._entries.pop(digest)
+        digests = self._by_user.get(user_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[user_id]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""
+    Login throttling, to keep credential-stuffing bursts from pinning every
+    core on password hashing.
+"""
+import os
+import time
+import threading
+import contextlib
+from collections import OrderedDict
+from typing import Iterator
+
+
+class TokenBucketLimiter:
+    """
+        One token bucket per key: a key may spend `burst` attempts at once,
+        then `rate` attempts per second.
+
+        At most `max_keys` buckets are kept. Only buckets that have refilled
+        are dropped, least recently used first: a full bucket is the same as
+        no bucket, so dropping one never hands a key back spent attempts.
+        When every kept bucket is still refilling, new keys share a fixed
+        table of `overflow_slots` buckets indexed by a hash of the key, and
+        a key later given its own bucket starts from its shared one. Flooding
+        the limiter with fresh keys therefore cannot reset anyone's bucket,
+        at worst it makes unlucky keys share attempts.
+    """
+    def __init__(self, rate: float, burst: int, max_keys: int = 100000,
+                 overflow_slots: int = 4096):
+        """create an empty limiter"""
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._overflow = [None] * overflow_slots
+        self._lock = threading.Lock()
+
+    def _refill(self, bucket, now: float) -> float:
+        """tokens in a (tokens, last) bucket at time now"""
+        if bucket is None:
+            return self.burst
+        tokens, last = bucket
+        return min(self.burst, tokens + (now - last) * self.rate)
+
+    def _prune(self, now: float) -> None:
+        """drop the least recently used buckets that have refilled"""
+        while self._buckets:
+            key = next(iter(self._buckets))
+            if self._refill(self._buckets[key], now) < self.burst:
+                return
+            del self._buckets[key]
+
+    def allow(self, key: str) -> bool:
+        """
+            spend a token for key, returns False if its bucket is empty.
+        """
+        now = time.monotonic()
+        with self._lock:
+            slot = hash(key) % len(self._overflow)
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = self._overflow[slot]
+                if len(self._buckets) >= self.max_keys:
+                    self._prune(now)
+            tokens = self._refill(bucket, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            if len(self._buckets) < self.max_keys:
+                self._buckets[key] = (tokens, now)
+            else:
+                self._overflow[slot] = (tokens, now)
+            return allowed
+
+    def __len__(self) -> int:
+        """number of buckets kept"""
+        return len(self._buckets)
+
+
+class LoginThrottle:
+    """
+        Limits login attempts per email and per client IP, and caps the
+        number of password checks running at the same time.
+    """
+    def __init__(self, email_rate: float = 0.1, email_burst: int = 5,
+                 ip_rate: float = 1.0, ip_burst: int = 20,
+                 max_concurrent: int = None, max_keys: int = 100000):
+        """
+            rates are attempts per second, max_concurrent defaults to twice
+            the number of cores.
+        """
+        self.per_email = TokenBucketLimiter(email_rate, email_burst, max_keys)
+        self.per_ip = TokenBucketLimiter(ip_rate, ip_burst, max_keys)
+        self.max_concurrent = max_concurrent or 2 * (os.cpu_count() or 1)
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+
+    @classmethod
+    def from_env(cls) -> "LoginThrottle":
+        """
+            configure from the LOGIN_THROTTLE_* environment variables.
+        """
+        concurrent = os.getenv("LOGIN_THROTTLE_CONCURRENT")
+        return cls(
+            email_rate=float(os.getenv("LOGIN_THROTTLE_EMAIL_RATE", "0.1")),
+            email_burst=int(os.getenv("LOGIN_THROTTLE_EMAIL_BURST", "5")),
+            ip_rate=float(os.getenv("LOGIN_THROTTLE_IP_RATE", "1")),
+            ip_burst=int(os.getenv("LOGIN_THROTTLE_IP_BURST", "20")),
+            max_concurrent=int(concurrent) if concurrent else None,
+            max_keys=int(os.getenv("LOGIN_THROTTLE_KEYS", "100000")))
+
+    def allow(self, email: str, ip: str) -> bool:
+        """
+            spend an attempt for the client IP and the email.
+        """
+        return self.per_ip.allow(str(ip)) and self.per_email.allow(str(email))
+
+    @contextlib.contextmanager
+    def hash_slot(self) -> Iterator[bool]:
+        """
+            yields whether a password check may run now; the slot is held
+            until the block exits.
+        """
+        acquired = self._slots.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._slots.release()
+
+
+login_throttle = LoginThrottle.from_env()
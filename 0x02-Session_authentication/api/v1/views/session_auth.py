@@ -9,13 +9,16 @@ from typing import Tuple
 from flask import abort, jsonify, request
 from models.user import User
 from api.v1.views import app_views
+from api.v1.auth.throttle import login_throttle
 
 
 @app_views.route('/auth_session/login', methods=['POST'], strict_slashes=False)
 def login() -> Tuple[str, int]:
     """
         Flask view that handles all routes for the Session authentication.
+        Throttled attempts get a 429 before the password is checked.
     """
+    error_too_many = {"error": "too many login attempts"}
     error_not_found = {"error": "no user found for this email"}
 
     email = request.form.get('email')
@@ -26,6 +29,9 @@ def login() -> Tuple[str, int]:
     if not password or not password.strip():
         return jsonify({"error": "password missing"}), 400
 
+    if not login_throttle.allow(email, request.remote_addr):
+        return jsonify(error_too_many), 429
+
     try:
         users = User.search({'email': email})
     except Exception:
@@ -33,7 +39,11 @@ def login() -> Tuple[str, int]:
     if len(users) <= 0:
         return jsonify(error_not_found), 404
 
-    if users[0].is_valid_password(password):
+    with login_throttle.hash_slot() as acquired:
+        if not acquired:
+            return jsonify(error_too_many), 429
+        valid = users[0].is_valid_password(password)
+    if valid:
         from api.v1.app import auth
         session_id = auth.create_session(getattr(users[0], 'id'))
         res = jsonify(users[0].to_json())
@@ -1,19 +1,80 @@
 #!/usr/bin/env python3
 """ Module of Users views
 """
+from typing import Iterator
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import abort, jsonify, request, Response
 from models.user import User
+import json
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK = 1000
+STREAM_FORMATS = {"json": "application/json",
+                  "ndjson": "application/x-ndjson"}
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: number of User objects of the page, at most 1000
+      - after: ID of the last User of the previous page
+      - stream: "json" or "ndjson", to stream all User objects
     Return:
       - list of all User objects JSON represented
+      - with limit or after, list of the User objects of the page in ID
+        order, and the ID to pass as after for the next page in the
+        X-Next-Cursor header if there is one
+      - with stream, all User objects in ID order, streamed as a JSON list
+        or one JSON object per line
+      - 400 if limit isn't a positive integer or stream is unknown
+    """
+    stream = request.args.get("stream")
+    if stream is not None:
+        if stream not in STREAM_FORMATS:
+            return jsonify({'error': "Unknown stream format"}), 400
+        return Response(stream_users(stream),
+                        mimetype=STREAM_FORMATS[stream])
+
+    if "limit" not in request.args and "after" not in request.args:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+
+    try:
+        limit = int(request.args.get("limit", PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return jsonify({'error': "limit must be a positive integer"}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
+    users = User.page(request.args.get("after"), limit + 1)
+    response = jsonify([user.to_json() for user in users[:limit]])
+    if len(users) > limit:
+        response.headers["X-Next-Cursor"] = users[limit - 1].id
+    return response
+
+
+def stream_users(stream_format: str) -> Iterator[str]:
+    """ JSON of all User objects in ID order, STREAM_CHUNK at a time
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    separator = "," if stream_format == "json" else "\n"
+    if stream_format == "json":
+        yield "["
+    after = None
+    while True:
+        users = User.page(after, STREAM_CHUNK)
+        if not users:
+            break
+        chunk = separator.join(json.dumps(user.to_json()) for user in users)
+        if stream_format == "json" and after is not None:
+            chunk = "," + chunk
+        elif stream_format == "ndjson":
+            chunk += "\n"
+        yield chunk
+        after = users[-1].id
+    if stream_format == "json":
+        yield "]"
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
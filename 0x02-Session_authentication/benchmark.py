@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+""" Benchmarks of the models store
+
+Usage:
+    python3 benchmark.py search [--users N]
+    python3 benchmark.py load [--users N]
+    python3 benchmark.py memory [--users N]
+    python3 benchmark.py stress [--users N] [--readers N] [--writers N]
+                                [--seconds S]
+    python3 benchmark.py backends [--users N]
+    python3 benchmark.py listing [--users N]
+"""
+import os
+import sys
+import time
+import types
+import random
+import threading
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from models import snapshot
+from models.base import Base, DATA, INDEXES
+from models.storage import BACKENDS, FileStorage, Storage
+from models.user import User
+
+
+def populate(users: int) -> List[User]:
+    """ Store `users` users in memory, without writing the file
+    """
+    created = [User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i),
+                    last_name="Last{}".format(i))
+               for i in range(users)]
+    Storage._replace(User, {user.id: user for user in created})
+    return created
+
+
+@contextmanager
+def temporary_directory() -> Iterator[str]:
+    """ Run the block in a new temporary working directory
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            yield tmp_dir
+        finally:
+            os.chdir(cwd)
+
+
+@contextmanager
+def using_storage(storage: Storage) -> Iterator[Storage]:
+    """ Store the objects of Base in storage for the block
+    """
+    previous = Base.storage
+    Base.storage = storage
+    try:
+        yield storage
+    finally:
+        storage.flush()
+        Base.storage = previous
+
+
+def bench_search(users: int, lookups: int = 1000) -> dict:
+    """ Time User.search by email against a full scan of the users
+    """
+    populate(users)
+    emails = ["user{}@example.com".format(i * users // lookups)
+              for i in range(lookups)]
+    start = time.perf_counter()
+    for email in emails:
+        assert len(User.search({'email': email})) == 1
+    indexed = (time.perf_counter() - start) / lookups
+
+    scans = max(1, min(lookups, 10))
+    start = time.perf_counter()
+    for email in emails[:scans]:
+        assert len([u for u in DATA['User'].values()
+                    if u.email == email]) == 1
+    scanned = (time.perf_counter() - start) / scans
+    return {"users": users, "indexed_us": indexed * 1e6,
+            "scan_us": scanned * 1e6}
+
+
+def bench_load(users: int) -> dict:
+    """ Time User.load_from_file from a snapshot in each format
+
+    The snapshots are written in a temporary directory.
+    """
+    populate(users)
+    result = {"users": users}
+    with temporary_directory():
+        for file_format in snapshot.READERS:
+            with using_storage(FileStorage(snapshot_format=file_format)):
+                User.save_to_file()
+                size = os.path.getsize(snapshot.snapshot_path(User,
+                                                              file_format))
+                start = time.perf_counter()
+                User.load_from_file()
+                result[file_format] = (time.perf_counter() - start, size)
+                assert User.count() == users
+    return result
+
+
+def bench_memory(users: int) -> dict:
+    """ Bytes per user of the __slots__ layout against a __dict__ one
+
+    Both layouts are built over the attribute values of the same users,
+    so only the objects themselves are measured; the values are counted
+    apart.
+    """
+    stored = populate(users)
+    names = User._slots()
+    set_attr = object.__setattr__
+
+    def measure(build) -> float:
+        """ Bytes per user allocated by building every user with build
+        """
+        tracemalloc.start()
+        built = [build(user) for user in stored]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(built) == users
+        return size / users
+
+    def slotted(user: User) -> User:
+        """ Copy of user in the __slots__ layout
+        """
+        copy = User.__new__(User)
+        for name in names:
+            set_attr(copy, name, getattr(user, name))
+        return copy
+
+    def with_dict(user: User) -> types.SimpleNamespace:
+        """ Copy of user in a __dict__ layout
+        """
+        return types.SimpleNamespace(
+            **{name: getattr(user, name) for name in names})
+
+    values = sum(sys.getsizeof(getattr(user, name)) for user in stored
+                 for name in names if getattr(user, name) is not None)
+    return {"users": users, "slots": measure(slotted),
+            "dict": measure(with_dict), "values": values / users}
+
+
+def bench_stress(users: int, readers: int, writers: int,
+                 seconds: float) -> dict:
+    """ Run concurrent readers and writers of User, then check the store
+
+    Readers get users by id, search them by email, count and list them;
+    writers create users, change their emails, remove them and save the
+    file, in a temporary directory. Any exception, a thread still running
+    at the end or an index out of step with DATA fails the run.
+    """
+    populate(users)
+    ids = list(DATA['User'])
+    stop = threading.Event()
+    errors = []
+    reads = [0] * readers
+    writes = [0] * writers
+
+    def reader(n: int):
+        """ Read until stopped
+        """
+        rnd = random.Random(n)
+        while not stop.is_set():
+            user = User.get(rnd.choice(ids))
+            if user is not None:
+                User.search({'email': user.email})
+            User.count()
+            reads[n] += 3
+            if reads[n] % 300 == 0:
+                User.all()
+                reads[n] += 1
+
+    def writer(n: int):
+        """ Write until stopped
+        """
+        rnd = random.Random(-n - 1)
+        while not stop.is_set():
+            op = rnd.random()
+            if op < 0.4:
+                User(email="new{}-{}@example.com".format(
+                    n, writes[n])).save()
+            elif op < 0.99:
+                user = User.get(rnd.choice(ids))
+                if user is not None and op < 0.8:
+                    user.email = "moved{}-{}@example.com".format(
+                        n, writes[n])
+                    user.save()
+                elif user is not None:
+                    user.remove()
+            else:
+                User.save_to_file()
+            writes[n] += 1
+
+    def run(target, n: int):
+        """ Run target(n), recording its exception
+        """
+        try:
+            target(n)
+        except Exception as e:
+            errors.append(e)
+
+    with temporary_directory():
+        threads = [threading.Thread(target=run, args=(reader, n))
+                   for n in range(readers)]
+        threads += [threading.Thread(target=run, args=(writer, n))
+                    for n in range(writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join(10)
+        User.flush()
+
+    assert not errors, errors
+    assert not any(thread.is_alive() for thread in threads), "deadlock"
+    stored = DATA['User']
+    for user in stored.values():
+        assert user in User.search({'email': user.email})
+    assert sum(len(bucket) for bucket in
+               INDEXES['User']['email'].values()) == len(stored)
+    return {"users": len(stored), "reads": sum(reads) / seconds,
+            "writes": sum(writes) / seconds}
+
+
+def bench_backends(users: int) -> dict:
+    """ Run the same workload of User through every storage backend
+
+    Each backend, with its default options, starts empty in a temporary
+    directory. Return the operations per second of each step, by backend.
+    """
+    rnd = random.Random(0)
+    result = {}
+    for name, backend in BACKENDS.items():
+        steps = {}
+        with temporary_directory(), using_storage(backend()):
+            User.load_from_file()
+
+            def step(label: str, ops: list):
+                """ Time the calls of ops
+                """
+                start = time.perf_counter()
+                for op in ops:
+                    op()
+                steps[label] = len(ops) / (time.perf_counter() - start)
+
+            created = [User(email="user{}@example.com".format(i))
+                       for i in range(users)]
+            step("create", [user.save for user in created])
+            ids = [rnd.choice(created).id for _ in range(users)]
+            step("get", [lambda i=i: User.get(i) for i in ids])
+            step("search", [
+                lambda i=i: User.search(
+                    {'email': "user{}@example.com".format(i)})
+                for i in range(users)])
+
+            def update(user: User):
+                """ Change the email of user
+                """
+                user.email = "updated-" + user.email
+                user.save()
+            step("update", [lambda u=u: update(u)
+                            for u in created[:users // 2]])
+            step("all", [User.all] * 10)
+            step("delete", [user.remove for user in created[:users // 4]])
+            assert User.count() == users - users // 4
+        result[name] = steps
+    return result
+
+
+def bench_listing(users: int) -> dict:
+    """ Peak memory and time of GET /api/v1/users, as one list and streamed
+
+    The view is called directly, without authentication.
+    """
+    from api.v1.app import app
+    from api.v1.views.users import view_all_users
+
+    populate(users)
+    result = {"users": users}
+    for label, query in (("list", ""), ("json", "?stream=json"),
+                         ("ndjson", "?stream=ndjson")):
+        with app.test_request_context("/api/v1/users" + query):
+            tracemalloc.start()
+            start = time.perf_counter()
+            size = sum(len(chunk) for chunk in view_all_users().response)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        result[label] = (elapsed, peak, size)
+    return result
+
+
+def main(argv: List[str] = None):
+    """ Run the benchmark named on the command line
+    """
+    parser = argparse.ArgumentParser(prog="benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search", help="User.search by email")
+    search.add_argument("--users", type=int, default=100000)
+    load = commands.add_parser("load", help="User.load_from_file by format")
+    load.add_argument("--users", type=int, default=100000)
+    memory = commands.add_parser("memory", help="bytes per User in memory")
+    memory.add_argument("--users", type=int, default=100000)
+    stress = commands.add_parser("stress",
+                                 help="concurrent readers and writers")
+    backends = commands.add_parser("backends",
+                                   help="same workload on every backend")
+    backends.add_argument("--users", type=int, default=2000)
+    listing = commands.add_parser("listing", help="GET /api/v1/users")
+    listing.add_argument("--users", type=int, default=100000)
+    stress.add_argument("--users", type=int, default=10000)
+    stress.add_argument("--readers", type=int, default=8)
+    stress.add_argument("--writers", type=int, default=4)
+    stress.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "search":
+        result = bench_search(args.users)
+        print("{users} users: search by email {indexed_us:.1f} us, "
+              "full scan {scan_us:.1f} us".format(**result))
+    elif args.command == "load":
+        result = bench_load(args.users)
+        for file_format in snapshot.READERS:
+            seconds, size = result[file_format]
+            print("{} users: {} snapshot {:.3f} s, {} bytes".format(
+                args.users, file_format, seconds, size))
+    elif args.command == "memory":
+        result = bench_memory(args.users)
+        print("{users} users: __slots__ {slots:.0f} bytes/user, __dict__ "
+              "{dict:.0f} bytes/user, values {values:.0f} bytes/user".format(
+                  **result))
+    elif args.command == "stress":
+        result = bench_stress(args.users, args.readers, args.writers,
+                              args.seconds)
+        print("{users} users left, consistent: {reads:.0f} reads/s, "
+              "{writes:.0f} writes/s".format(**result))
+    elif args.command == "backends":
+        result = bench_backends(args.users)
+        for name, steps in result.items():
+            print("{}: {}".format(name, ", ".join(
+                "{} {:.0f}/s".format(label, ops)
+                for label, ops in steps.items())))
+    elif args.command == "listing":
+        result = bench_listing(args.users)
+        for label in ("list", "json", "ndjson"):
+            seconds, peak, size = result[label]
+            print("{} users: {} {:.2f} s, peak {:.1f} MB, {} bytes".format(
+                args.users, label, seconds, peak / 2 ** 20, size))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,39 +2,173 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
-import json
+from operator import attrgetter
+from typing import Callable, Dict, TypeVar, List, Iterable, Tuple
 import uuid
+import atexit
+from models import snapshot
+from models.storage import DATA, INDEXES, data_lock, gc_paused, Storage, \
+    storage_from_env
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+SLOTS = {}
+LISTENERS = {}
+_UNSET = object()
 
 
 class Base():
     """ Base class
+
+    Subclasses list in `indexed_attributes` the attributes `search` should
+    find in constant time. Stored objects are kept in a hash index per
+    attribute, in INDEXES[class name][attribute][value][id], updated by
+    `save`, `remove` and by assigning the attribute. A load drops them,
+    to be built again in one pass on first use.
+
+    Objects are stored by `storage`, the backend named by BASE_STORE (see
+    models.storage), in files by default. `Base.flush()` persists the
+    writes still waiting in write-behind mode, and runs at interpreter
+    exit.
+
+    Attributes are kept in `__slots__` rather than a per-object __dict__:
+    subclasses declare their own, or get a __dict__ for any other
+    attribute by declaring none.
     """
 
+    __slots__ = ('id', 'created_at', 'updated_at')
+    indexed_attributes: Tuple[str, ...] = ()
+    storage: Storage = storage_from_env()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+        DATA.setdefault(s_class, {})
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = snapshot.parse_timestamp(
+                kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = snapshot.parse_timestamp(
+                kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, keeping its index up to date
+
+        The first assignment of an attribute of an object not stored, as
+        done by __init__, takes no lock: nothing else can see it yet.
+        """
+        if name not in self.indexed_attributes or (
+                getattr(self, name, _UNSET) is _UNSET
+                and not self._is_stored()):
+            super().__setattr__(name, value)
+            return
+        with data_lock.write():
+            if self._is_stored():
+                self._unindex(name)
+                super().__setattr__(name, value)
+                self._index(name)
+            else:
+                super().__setattr__(name, value)
+
+    def _is_stored(self) -> bool:
+        """ Whether this object is the one stored under its id
+        """
+        objs = DATA.get(self.__class__.__name__)
+        return objs is not None and objs.get(getattr(self, 'id', None)) is self
+
+    @classmethod
+    def _slots(cls) -> Tuple[str, ...]:
+        """ Names of the slots of this class, from Base's down
+        """
+        slots = SLOTS.get(cls)
+        if slots is None:
+            slots = SLOTS[cls] = tuple(
+                name for klass in reversed(cls.__mro__)
+                for name in klass.__dict__.get('__slots__', ())
+                if name not in ('__dict__', '__weakref__'))
+        return slots
+
+    def _attributes(self) -> Iterable[Tuple[str, object]]:
+        """ Names and values of the attributes set on this object
+        """
+        for name in self._slots():
+            try:
+                yield name, getattr(self, name)
+            except AttributeError:
+                pass
+        yield from getattr(self, '__dict__', {}).items()
+
+    @classmethod
+    def _indexes(cls) -> dict:
+        """ Indexes of this class, by attribute, built on first use
+        """
+        indexes = INDEXES.get(cls.__name__)
+        if indexes is None:
+            with gc_paused():
+                indexes = INDEXES.setdefault(cls.__name__, cls._build_indexes(
+                    DATA.get(cls.__name__, {})))
+        return indexes
+
+    def _index(self, *attrs: str):
+        """ Add this object to the indexes of attrs, all by default
+        """
+        indexes = self._indexes()
+        for attr in attrs or self.indexed_attributes:
+            value = getattr(self, attr, None)
+            try:
+                indexes[attr].setdefault(value, {})[self.id] = self
+            except TypeError:
+                pass
+
+    @classmethod
+    def _build_indexes(cls, objs: Dict[str, TypeVar('Base')]) -> dict:
+        """ Indexes of objs, by id
+
+        Attributes with unique values, as after most loads, are indexed in
+        one pass, others object by object as by `_index`.
+        """
+        indexes = {}
+        for attr in cls.indexed_attributes:
+            try:
+                values = list(map(attrgetter(attr), objs.values()))
+                unique = len(set(values)) == len(values)
+            except (AttributeError, TypeError):
+                unique = False
+            if unique:
+                indexes[attr] = {value: {obj_id: obj} for value, obj_id, obj
+                                 in zip(values, objs, objs.values())}
+                continue
+            index = indexes[attr] = {}
+            for obj_id, obj in objs.items():
+                try:
+                    index.setdefault(getattr(obj, attr, None),
+                                     {})[obj_id] = obj
+                except TypeError:
+                    pass
+        return indexes
+
+    def _unindex(self, *attrs: str):
+        """ Remove this object from the indexes of attrs, all by default
+        """
+        indexes = self._indexes()
+        for attr in attrs or self.indexed_attributes:
+            value = getattr(self, attr, None)
+            try:
+                bucket = indexes[attr].get(value)
+            except TypeError:
+                continue
+            if bucket is not None and bucket.get(self.id) is self:
+                del bucket[self.id]
+                if not bucket:
+                    del indexes[attr][value]
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -48,7 +182,7 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -59,79 +193,78 @@ class Base():
 
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from the storage
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        cls.storage.load(cls)
 
     @classmethod
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Persist all objects to the storage
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        cls.storage.save_all(cls)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @staticmethod
+    def flush():
+        """ Persist every save and remove still waiting in write-behind mode
+        """
+        Base.storage.flush()
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        self.storage.upsert(self)
+        self._notify("save")
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        if self.storage.delete(self):
+            self._notify("remove")
+
+    @classmethod
+    def add_listener(cls, callback: Callable[[str, TypeVar('Base')], None]):
+        """ Call `callback(event, obj)` after each save or remove of an
+        object of this class, with event "save" or "remove"
+        """
+        LISTENERS.setdefault(cls.__name__, []).append(callback)
+
+    def _notify(self, event: str):
+        """ Call the listeners of this class
+        """
+        for callback in LISTENERS.get(self.__class__.__name__, ()):
+            callback(event, self)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return cls.storage.count(cls)
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
         """ Return all objects
         """
-        return cls.search()
+        return list(cls.storage.iterate(cls))
 
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return cls.storage.get(cls, id)
+
+    @classmethod
+    def page(cls, after: str = None,
+             limit: int = 100) -> List[TypeVar('Base')]:
+        """ Return at most limit objects in ID order, after the ID after
+        """
+        return cls.storage.page(cls, after, limit)
 
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return cls.storage.search(cls, attributes)
+
+
+atexit.register(Base.flush)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+""" Reader/writer lock module
+"""
+import threading
+
+
+class _Hold():
+    """ Context manager taking a lock with acquire, then release
+    """
+
+    __slots__ = ('_acquire', '_release')
+
+    def __init__(self, acquire, release):
+        """ Initialize a hold of a lock
+        """
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        """ Take the lock
+        """
+        self._acquire()
+
+    def __exit__(self, *exc_info):
+        """ Release the lock
+        """
+        self._release()
+
+
+class ReadWriteLock():
+    """ Lock shared by any number of readers, or held by one writer
+
+    Writers are preferred: once one waits, new readers wait for it, so a
+    steady flow of readers cannot starve it. The writer may take the lock
+    again, to read or to write, while it holds it; readers may not.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._read = _Hold(self.acquire_read, self.release_read)
+        self._write = _Hold(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        """ Wait for no writer to hold or wait for the lock, then share it
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        """ Release a shared hold of the lock
+        """
+        with self._cond:
+            if self._writer == threading.get_ident():
+                self._release_write()
+                return
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        """ Wait for the lock to be free, then hold it alone
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        """ Release the lock held by this thread
+        """
+        with self._cond:
+            self._release_write()
+
+    def _release_write(self):
+        """ Release one hold of the writer, the lock being taken
+        """
+        self._writer_depth -= 1
+        if self._writer_depth == 0:
+            self._writer = None
+            self._cond.notify_all()
+
+    def read(self) -> _Hold:
+        """ Context manager holding the lock shared for its block
+        """
+        return self._read
+
+    def write(self) -> _Hold:
+        """ Context manager holding the lock alone for its block
+        """
+        return self._write
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+""" Shared store module
+"""
+from typing import Dict, List, Optional, Tuple
+import os
+import json
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    class TEXT PRIMARY KEY,
+    gen INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS objects (
+    class TEXT NOT NULL,
+    id TEXT NOT NULL,
+    gen INTEGER NOT NULL,
+    data TEXT,
+    PRIMARY KEY (class, id)
+);
+CREATE INDEX IF NOT EXISTS objects_gen ON objects (class, gen);
+"""
+
+Change = Tuple[str, Optional[dict]]
+
+
+class SharedStore():
+    """ SQLite database of objects, shared by the processes of one host
+
+    The database is in WAL mode, so readers never wait for a writer. Each
+    class has a generation, bumped by every write: rows hold the
+    generation that last wrote them, removed objects are kept as rows
+    without data, so a process that saw generation G catches up by
+    reading the rows above G.
+
+    Connections are opened per thread and per process, a forked worker
+    opening its own.
+    """
+
+    def __init__(self, db_path: str, timeout: float = 30.0):
+        """ Initialize a store in the database at db_path
+        """
+        self.db_path = os.path.abspath(db_path)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Connection of this thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _generation(conn: sqlite3.Connection, s_class: str) -> int:
+        """ Generation of s_class in the transaction of conn
+        """
+        row = conn.execute("SELECT gen FROM generations WHERE class = ?",
+                           (s_class,)).fetchone()
+        return 0 if row is None else row[0]
+
+    @staticmethod
+    def _changes(conn: sqlite3.Connection, s_class: str,
+                 since: int) -> List[Change]:
+        """ (id, data or None if removed) of the rows written after since
+        """
+        rows = conn.execute("SELECT id, data FROM objects WHERE class = ? "
+                            "AND gen > ? ORDER BY gen", (s_class, since))
+        return [(obj_id, None if data is None else json.loads(data))
+                for obj_id, data in rows]
+
+    def generation(self, s_class: str) -> int:
+        """ Last generation of s_class, 0 before its first write
+        """
+        return self._generation(self._connection(), s_class)
+
+    def changes(self, s_class: str, since: int) -> Tuple[int, List[Change]]:
+        """ Generation of s_class and the changes after generation since
+        """
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            return (self._generation(conn, s_class),
+                    self._changes(conn, s_class, since))
+        finally:
+            conn.execute("COMMIT")
+
+    def write(self, s_class: str, entries: List[Change],
+              since: int) -> Tuple[int, List[Change]]:
+        """ Write entries, (id, data or None to remove), in a new generation
+
+        Return the new generation with the changes of other writers after
+        generation since, which the entries override.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            written = {obj_id for obj_id, _ in entries}
+            changes = [change for change in self._changes(conn, s_class, since)
+                       if change[0] not in written]
+            gen = self._generation(conn, s_class) + 1
+            conn.execute("INSERT OR REPLACE INTO generations (class, gen) "
+                         "VALUES (?, ?)", (s_class, gen))
+            conn.executemany(
+                "INSERT OR REPLACE INTO objects (class, id, gen, data) "
+                "VALUES (?, ?, ?, ?)",
+                [(s_class, obj_id, gen,
+                  None if data is None else json.dumps(data))
+                 for obj_id, data in entries])
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return gen, changes
+
+    def load(self, s_class: str) -> Tuple[int, Dict[str, dict]]:
+        """ Generation of s_class and the data of its objects, by id
+        """
+        gen, changes = self.changes(s_class, 0)
+        return gen, {obj_id: data for obj_id, data in changes
+                     if data is not None}
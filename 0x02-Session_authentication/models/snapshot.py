@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+""" Snapshot formats of the file store
+
+- "json": {id: obj.to_json(True)}, the historical .db_<class>.json file.
+- "pickle": a pickle (protocol 5) of a columnar layout, one list of values
+  per attribute, in .db_<class>.pkl. Objects are rebuilt in bulk without
+  going through __init__: each column is mapped onto the objects through
+  the slot descriptor of its attribute, and timestamps are parsed with
+  datetime.fromisoformat. This is still short of a sub-second cold start
+  for a million users: loading one takes about 2.5 s, 1 s of which is
+  pickle.load itself, as every object is built at load.
+
+Convert a snapshot between formats with:
+
+    python3 -m models.snapshot User json pickle
+"""
+from collections import deque
+from datetime import datetime
+from itertools import repeat
+from types import MemberDescriptorType
+from typing import Callable, Dict, Iterable, List
+from os import path
+import os
+import sys
+import json
+import pickle
+
+
+EXTENSIONS = {"json": "json", "pickle": "pkl"}
+TIMESTAMP_ATTRIBUTES = ("created_at", "updated_at")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a timestamp written by Base.to_json
+    """
+    return None if value is None else datetime.fromisoformat(value)
+
+
+def read_json(cls: type, file_path: str) -> Dict[str, object]:
+    """ Objects of a JSON snapshot, by id
+    """
+    with open(file_path, 'r') as f:
+        objs_json = json.load(f)
+    return {obj_id: cls(**obj_json) for obj_id, obj_json in objs_json.items()}
+
+
+def write_json(objs: Iterable[object], file_path: str):
+    """ Write a JSON snapshot
+    """
+    with open(file_path, 'w') as f:
+        json.dump({obj.id: obj.to_json(True) for obj in objs}, f)
+
+
+def parse_timestamps(values: List[str]) -> List[datetime]:
+    """ Parse a column of timestamps written by Base.to_json
+    """
+    if None in values:
+        return list(map(parse_timestamp, values))
+    return list(map(datetime.fromisoformat, values))
+
+
+def attribute_setter(cls: type, name: str) -> Callable[[object, object],
+                                                       None]:
+    """ Function setting the attribute name of an object of cls, without
+    going through cls.__setattr__
+    """
+    descriptor = getattr(cls, name, None)
+    if isinstance(descriptor, MemberDescriptorType):
+        return descriptor.__set__
+
+    def set_attr(obj: object, value: object):
+        object.__setattr__(obj, name, value)
+    return set_attr
+
+
+def read_pickle(cls: type, file_path: str) -> Dict[str, object]:
+    """ Objects of a columnar pickle snapshot, by id
+    """
+    with open(file_path, 'rb') as f:
+        columns = pickle.load(f)["columns"]
+    if "id" not in columns:
+        return {}
+    objs = list(map(cls.__new__, repeat(cls, len(columns["id"]))))
+    for name, values in columns.items():
+        if name in TIMESTAMP_ATTRIBUTES:
+            values = parse_timestamps(values)
+        deque(map(attribute_setter(cls, name), objs, values), maxlen=0)
+    return dict(zip(columns["id"], objs))
+
+
+def write_pickle(objs: Iterable[object], file_path: str):
+    """ Write a columnar pickle snapshot
+    """
+    rows = [obj.to_json(True) for obj in objs]
+    names = {}
+    for row in rows:
+        names.update(dict.fromkeys(row))
+    columns = {name: [row.get(name) for row in rows] for name in names}
+    with open(file_path, 'wb') as f:
+        pickle.dump({"version": 1, "columns": columns}, f, protocol=5)
+
+
+READERS = {"json": read_json, "pickle": read_pickle}
+WRITERS = {"json": write_json, "pickle": write_pickle}
+
+
+def snapshot_path(cls: type, file_format: str) -> str:
+    """ Path of the snapshot of cls in a format
+    """
+    return ".db_{}.{}".format(cls.__name__, EXTENSIONS[file_format])
+
+
+def load(cls: type, file_format: str) -> Dict[str, object]:
+    """ Objects of the snapshot of cls, by id
+
+    The snapshot in `file_format` is read if it exists, else one in another
+    format; no snapshot at all means no objects.
+    """
+    others = [other for other in READERS if other != file_format]
+    for candidate in [file_format] + others:
+        file_path = snapshot_path(cls, candidate)
+        if path.exists(file_path):
+            return READERS[candidate](cls, file_path)
+    return {}
+
+
+def save(cls: type, objs: Iterable[object], file_format: str,
+         keep_others: bool = False) -> str:
+    """ Atomically replace the snapshot of cls in a format
+
+    Snapshots in other formats are removed unless `keep_others` is set, so
+    that a stale one is never loaded later.
+    """
+    file_path = snapshot_path(cls, file_format)
+    tmp_path = "{}.tmp".format(file_path)
+    WRITERS[file_format](objs, tmp_path)
+    os.replace(tmp_path, file_path)
+    if not keep_others:
+        for other in READERS:
+            if other != file_format and path.exists(snapshot_path(cls, other)):
+                os.remove(snapshot_path(cls, other))
+    return file_path
+
+
+def convert(cls: type, source: str, target: str) -> str:
+    """ Write the `source` snapshot of cls in the `target` format
+    """
+    objs = READERS[source](cls, snapshot_path(cls, source))
+    return save(cls, objs.values(), target, keep_others=True)
+
+
+def main(argv: List[str] = None):
+    """ Convert a snapshot: <class name> <source format> <target format>
+    """
+    import models.user
+    from models.base import Base
+
+    if argv is None or len(argv) != 3 or argv[1] not in READERS \
+            or argv[2] not in READERS:
+        print("usage: python3 -m models.snapshot <class> <{0}> <{0}>".format(
+            "|".join(READERS)), file=sys.stderr)
+        sys.exit(2)
+    classes = {cls.__name__: cls for cls in Base.__subclasses__()}
+    print(convert(classes[argv[0]], argv[1], argv[2]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
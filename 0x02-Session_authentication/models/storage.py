@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+""" Storage backends of Base
+
+Base delegates to a backend, `Base.storage`, named by BASE_STORE:
+
+- "memory": MemoryStorage, objects lost at exit
+- "file" (default): FileStorage, a snapshot and a journal per class
+- "sqlite": SQLiteStorage, a SQLite database shared by the processes of
+  the host
+"""
+from typing import Dict, Iterator, List, Tuple, TypeVar
+from os import path
+from bisect import bisect_left, bisect_right, insort
+import os
+import gc
+import json
+import logging
+import contextlib
+import threading
+from models import snapshot
+from models.rwlock import ReadWriteLock
+from models.shared_store import SharedStore
+
+
+DATA = {}
+INDEXES = {}
+ORDERED_IDS = {}
+data_lock = ReadWriteLock()
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def gc_paused() -> Iterator[None]:
+    """ Keep the cyclic garbage collector from running in the block
+
+    A load allocates an object per stored one, none of which is garbage:
+    collections triggered meanwhile would scan them all, again and again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def journal_entry(obj: TypeVar('Base'), removed: bool = False) -> dict:
+    """ Journal line of a save or removal
+    """
+    if removed:
+        return {"op": "remove", "id": obj.id}
+    return {"op": "save", "obj": obj.to_json(True)}
+
+
+class Storage():
+    """ Storage of the objects of Base subclasses
+
+    Every backend keeps the objects of a class in memory, in
+    DATA[class name][id], in the indexes of Base, INDEXES, and their ids
+    sorted for `page` in ORDERED_IDS, all guarded by data_lock: `get`,
+    `count`, `page`, `search` and `iterate` share it, changes hold it
+    alone. Writes to the persistence hold a separate lock, taken before it
+    when both are needed, and listeners are called without either.
+    Backends differ in how they persist the objects, with `_read`,
+    `_write` and `save_all`, and may catch up with writes of other
+    processes in `_sync`, called before each read.
+
+    With write_behind, `upsert` and `delete` only mark the object dirty: a
+    background thread writes the dirty objects every flush_interval
+    seconds, or as soon as flush_size are waiting. Several writes of an
+    object in between are written once. `flush()` writes them right away.
+    Objects whose write fails stay dirty, to be written by the next flush.
+    """
+
+    def __init__(self, write_behind: bool = False,
+                 flush_interval: float = 1.0, flush_size: int = 500):
+        """ Initialize a backend
+        """
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = {}
+        self._pending_cond = threading.Condition()
+        self._write_lock = threading.RLock()
+        self._flusher = None
+
+    def _read(self, cls: type) -> Dict[str, TypeVar('Base')]:
+        """ Persisted objects of cls, by id
+        """
+        return {}
+
+    def _write(self, cls: type, entries: List[dict]):
+        """ Persist journal entries of cls
+        """
+
+    def _sync(self, cls: type):
+        """ Catch up with the writes of other processes
+        """
+
+    def save_all(self, cls: type):
+        """ Persist all objects of cls
+        """
+
+    def load(self, cls: type):
+        """ Replace the objects of cls in memory by the persisted ones
+        """
+        self.flush()
+        with gc_paused():
+            self._replace(cls, self._read(cls))
+
+    @staticmethod
+    def _replace(cls: type, objs: Dict[str, TypeVar('Base')]):
+        """ Replace the objects of cls in memory by objs
+        """
+        with data_lock.write():
+            DATA[cls.__name__] = objs
+            INDEXES.pop(cls.__name__, None)
+            ORDERED_IDS.pop(cls.__name__, None)
+
+    @staticmethod
+    def _ordered_ids(s_class: str) -> List[str]:
+        """ Sorted ids of the objects of s_class, built on first use
+        """
+        ids = ORDERED_IDS.get(s_class)
+        if ids is None:
+            ids = ORDERED_IDS.setdefault(s_class,
+                                         sorted(DATA.get(s_class, ())))
+        return ids
+
+    @staticmethod
+    def _order(s_class: str, obj_id: str, removed: bool = False):
+        """ Add or remove obj_id in the sorted ids, if already built
+        """
+        ids = ORDERED_IDS.get(s_class)
+        if ids is None:
+            return
+        if not removed:
+            insort(ids, obj_id)
+            return
+        i = bisect_left(ids, obj_id)
+        if i < len(ids) and ids[i] == obj_id:
+            del ids[i]
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Object of cls by id, None if there is none
+        """
+        self._sync(cls)
+        with data_lock.read():
+            return DATA.get(cls.__name__, {}).get(obj_id)
+
+    def count(self, cls: type) -> int:
+        """ Number of objects of cls
+        """
+        self._sync(cls)
+        with data_lock.read():
+            return len(DATA.get(cls.__name__, {}))
+
+    def iterate(self, cls: type) -> Iterator[TypeVar('Base')]:
+        """ Iterator over the objects of cls at the time of the call
+        """
+        self._sync(cls)
+        with data_lock.read():
+            return iter(list(DATA.get(cls.__name__, {}).values()))
+
+    def page(self, cls: type, after: str = None,
+             limit: int = 100) -> List[TypeVar('Base')]:
+        """ At most limit objects of cls in id order, after the id after
+
+        The order is stable across writes: paging with the id of the last
+        object of a page as the next after sees once every object stored
+        during the whole paging, and never one twice.
+        """
+        self._sync(cls)
+        with data_lock.read():
+            ids = self._ordered_ids(cls.__name__)
+            start = 0 if after is None else bisect_right(ids, after)
+            objs = DATA.get(cls.__name__, {})
+            return [objs[obj_id] for obj_id in ids[start:start + limit]]
+
+    def search(self, cls: type,
+               attributes: dict = {}) -> List[TypeVar('Base')]:
+        """ Objects of cls with matching attributes
+
+        When an attribute of the query is indexed, only the objects of its
+        index entry are scanned.
+        """
+        def _search(obj):
+            for k, v in attributes.items():
+                if (getattr(obj, k) != v):
+                    return False
+            return True
+
+        self._sync(cls)
+        with data_lock.read():
+            candidates = DATA.get(cls.__name__, {}).values()
+            for attr in cls.indexed_attributes:
+                if attr in attributes:
+                    try:
+                        bucket = cls._indexes()[attr].get(attributes[attr],
+                                                          {})
+                    except TypeError:
+                        continue
+                    candidates = bucket.values()
+                    break
+            return list(filter(_search, candidates))
+
+    def upsert(self, obj: TypeVar('Base')):
+        """ Store obj, replacing any object of its class with its id
+        """
+        with data_lock.write():
+            stored = DATA.setdefault(obj.__class__.__name__, {})
+            previous = stored.get(obj.id)
+            if previous is not obj:
+                if previous is not None:
+                    previous._unindex()
+                else:
+                    self._order(obj.__class__.__name__, obj.id)
+                stored[obj.id] = obj
+                obj._index()
+        self._journal(obj)
+
+    def delete(self, obj: TypeVar('Base')) -> bool:
+        """ Remove the object of the class of obj with its id, if any
+        """
+        with data_lock.write():
+            previous = DATA.get(obj.__class__.__name__, {}).pop(obj.id, None)
+            if previous is not None:
+                previous._unindex()
+                self._order(obj.__class__.__name__, obj.id, removed=True)
+        if previous is None:
+            return False
+        self._journal(obj, removed=True)
+        return True
+
+    def _journal(self, obj: TypeVar('Base'), removed: bool = False):
+        """ Persist the save or removal of obj, now or in the background
+        """
+        if not self.write_behind:
+            self._write(obj.__class__, [journal_entry(obj, removed)])
+            return
+        with self._pending_cond:
+            dirty = self._pending.setdefault(obj.__class__.__name__,
+                                             (obj.__class__, {}))[1]
+            dirty.pop(obj.id, None)
+            dirty[obj.id] = (obj, removed)
+            if sum(len(p[1]) for p in self._pending.values()) \
+                    >= self.flush_size:
+                self._pending_cond.notify()
+        self._start_flusher()
+
+    def flush(self):
+        """ Persist every save and remove still waiting in write-behind mode
+        """
+        with self._write_lock:
+            with self._pending_cond:
+                pending = list(self._pending.values())
+                self._pending.clear()
+            for i, (cls, dirty) in enumerate(pending):
+                try:
+                    self._write(cls, [journal_entry(obj, removed)
+                                      for obj, removed in dirty.values()])
+                except BaseException:
+                    self._requeue(pending[i:])
+                    raise
+
+    def _requeue(self, pending: List[Tuple[type, dict]]):
+        """ Mark dirty again objects whose write failed, unless written
+        since
+        """
+        with self._pending_cond:
+            for cls, dirty in pending:
+                current = self._pending.setdefault(cls.__name__, (cls, {}))[1]
+                for obj_id, change in dirty.items():
+                    current.setdefault(obj_id, change)
+
+    def _flush_loop(self):
+        """ Background flusher of the write-behind mode
+        """
+        while True:
+            with self._pending_cond:
+                self._pending_cond.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("write-behind flush failed, will retry")
+
+    def _start_flusher(self):
+        """ Start the background flusher, again if it died
+        """
+        if self._flusher is None or not self._flusher.is_alive():
+            with self._pending_cond:
+                if self._flusher is None or not self._flusher.is_alive():
+                    self._flusher = threading.Thread(
+                        target=self._flush_loop, daemon=True,
+                        name="Base-flusher")
+                    self._flusher.start()
+
+
+class MemoryStorage(Storage):
+    """ Objects kept in memory only, lost at exit
+    """
+
+
+class FileStorage(Storage):
+    """ Objects persisted in files of the working directory
+
+    A snapshot, .db_<class>.json (or the faster to load .db_<class>.pkl
+    with the "pickle" snapshot_format, see models.snapshot), and an
+    append-only journal, .db_<class>.journal, holding one JSON line per
+    save or remove since the snapshot. Once the journal has more entries
+    than both journal_min_entries and the number of objects, it is
+    compacted into a new snapshot, so a write costs O(1) amortized.
+    """
+
+    def __init__(self, snapshot_format: str = "json",
+                 journal_min_entries: int = 1000, **kwargs):
+        """ Initialize a file backend
+        """
+        super().__init__(**kwargs)
+        self.snapshot_format = snapshot_format
+        self.journal_min_entries = journal_min_entries
+        self.journal_sizes = {}
+
+    @staticmethod
+    def journal_path(cls: type) -> str:
+        """ Path of the journal of cls
+        """
+        return ".db_{}.journal".format(cls.__name__)
+
+    def _read(self, cls: type) -> Dict[str, TypeVar('Base')]:
+        """ Objects of the snapshot with the journal replayed, by id
+        """
+        s_class = cls.__name__
+        journal_path = self.journal_path(cls)
+        self.journal_sizes[s_class] = 0
+
+        objs = snapshot.load(cls, self.snapshot_format)
+        objs_json = {}
+        if path.exists(journal_path):
+            lines, torn = [], False
+            with open(journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a write cut short by a crash
+                        torn = True
+                        continue
+                    if not line.endswith(b"\n"):
+                        torn = True
+                        line += b"\n"
+                    lines.append(line)
+                    if entry["op"] == "save":
+                        objs_json[entry["obj"]["id"]] = entry["obj"]
+                    else:
+                        objs.pop(entry["id"], None)
+                        objs_json.pop(entry["id"], None)
+                    self.journal_sizes[s_class] += 1
+            if torn:
+                self._rewrite_journal(journal_path, lines)
+        for obj_id, obj_json in objs_json.items():
+            objs[obj_id] = cls(**obj_json)
+        return objs
+
+    def _rewrite_journal(self, journal_path: str, lines: List[bytes]):
+        """ Replace the journal by its complete lines
+
+        Entries appended after a torn line would otherwise be glued to it
+        and lost on the next load.
+        """
+        tmp_path = "{}.tmp".format(journal_path)
+        with self._write_lock:
+            with open(tmp_path, 'wb') as f:
+                f.write(b"".join(lines))
+            os.replace(tmp_path, journal_path)
+
+    def _write(self, cls: type, entries: List[dict]):
+        """ Append entries to the journal, compacting it when too long
+        """
+        s_class = cls.__name__
+        with self._write_lock:
+            with open(self.journal_path(cls), 'a') as f:
+                f.write("".join(json.dumps(entry) + "\n"
+                                for entry in entries))
+            self.journal_sizes[s_class] = \
+                self.journal_sizes.get(s_class, 0) + len(entries)
+            if self.journal_sizes[s_class] > max(
+                    self.journal_min_entries, len(DATA.get(s_class, ()))):
+                self.save_all(cls)
+
+    def save_all(self, cls: type):
+        """ Save all objects to a new snapshot and empty the journal
+
+        The snapshot replaces the old one atomically. Should the process
+        stop before the journal is emptied, replaying it over the new
+        snapshot gives the same objects.
+        """
+        with self._write_lock:
+            with data_lock.read():
+                objs = list(DATA[cls.__name__].values())
+            snapshot.save(cls, objs, self.snapshot_format)
+            open(self.journal_path(cls), 'w').close()
+            self.journal_sizes[cls.__name__] = 0
+
+
+class SQLiteStorage(Storage):
+    """ Objects persisted in a SQLite database shared by every process of
+    the host (see models.shared_store)
+
+    DATA is a cache of the database: reads first compare the generation of
+    the class in the database with the one of DATA, and catch up with the
+    objects written since by other processes, calling the listeners as for
+    local writes. On first use, the database is filled from the files of
+    FileStorage.
+    """
+
+    def __init__(self, db_path: str = ".db.sqlite3",
+                 snapshot_format: str = "json", **kwargs):
+        """ Initialize a SQLite backend
+        """
+        super().__init__(**kwargs)
+        self.shared = SharedStore(db_path)
+        self.snapshot_format = snapshot_format
+        self.generations = {}
+        self._lock = threading.RLock()
+
+    def load(self, cls: type):
+        """ Replace the objects of cls in memory by the persisted ones
+        """
+        self.flush()
+        with self._lock, gc_paused():
+            self._replace(cls, self._read(cls))
+
+    def _read(self, cls: type) -> Dict[str, TypeVar('Base')]:
+        """ Objects of the database, by id
+        """
+        s_class = cls.__name__
+        gen, objs_json = self.shared.load(s_class)
+        if gen == 0:
+            objs = FileStorage(self.snapshot_format)._read(cls)
+            if objs:
+                gen = self.shared.write(s_class, [
+                    (obj_id, obj.to_json(True))
+                    for obj_id, obj in objs.items()], 0)[0]
+        else:
+            objs = {obj_id: cls(**obj_json)
+                    for obj_id, obj_json in objs_json.items()}
+        self.generations[s_class] = gen
+        return objs
+
+    def _sync(self, cls: type):
+        """ Catch up with the writes of other processes to the database
+        """
+        s_class = cls.__name__
+        if self.shared.generation(s_class) == self.generations.get(s_class):
+            return
+        with self._lock:
+            gen, changes = self.shared.changes(
+                s_class, self.generations.get(s_class, 0))
+            events = self._apply(cls, changes)
+            self.generations[s_class] = gen
+        for event, obj in events:
+            obj._notify(event)
+
+    def _write(self, cls: type, entries: List[dict]):
+        """ Write journal entries to the database
+        """
+        s_class = cls.__name__
+        with self._lock:
+            gen, changes = self.shared.write(s_class, [
+                (entry["obj"]["id"], entry["obj"]) if entry["op"] == "save"
+                else (entry["id"], None) for entry in entries],
+                self.generations.get(s_class, 0))
+            events = self._apply(cls, changes)
+            self.generations[s_class] = gen
+        for event, obj in events:
+            obj._notify(event)
+
+    def save_all(self, cls: type):
+        """ Write all objects to the database
+        """
+        self._write(cls, [journal_entry(obj) for obj in self.iterate(cls)])
+
+    @staticmethod
+    def _apply(cls: type,
+               changes: list) -> List[Tuple[str, TypeVar('Base')]]:
+        """ Store the objects changed in the database
+
+        Return the ("save" or "remove", object) events to notify.
+        """
+        objs = [(obj_id, None if obj_json is None else cls(**obj_json))
+                for obj_id, obj_json in changes]
+        events = []
+        with data_lock.write():
+            stored = DATA.setdefault(cls.__name__, {})
+            for obj_id, obj in objs:
+                previous = stored.pop(obj_id, None)
+                if previous is not None:
+                    previous._unindex()
+                if (previous is None) != (obj is None):
+                    Storage._order(cls.__name__, obj_id, removed=obj is None)
+                if obj is not None:
+                    stored[obj_id] = obj
+                    obj._index()
+                    events.append(("save", obj))
+                elif previous is not None:
+                    events.append(("remove", previous))
+        return events
+
+
+BACKENDS = {"memory": MemoryStorage, "file": FileStorage,
+            "sqlite": SQLiteStorage}
+
+
+def storage_from_env() -> Storage:
+    """ Backend named by BASE_STORE, configured by environment variables
+
+    BASE_WRITE_BEHIND, BASE_FLUSH_INTERVAL and BASE_FLUSH_SIZE for every
+    backend, BASE_SNAPSHOT_FORMAT and BASE_JOURNAL_MIN_ENTRIES for the
+    files, BASE_SHARED_DB for the SQLite database.
+    """
+    name = os.getenv('BASE_STORE', 'file')
+    options = {
+        "write_behind": os.getenv('BASE_WRITE_BEHIND', '0') == '1',
+        "flush_interval": float(os.getenv('BASE_FLUSH_INTERVAL', '1.0')),
+        "flush_size": int(os.getenv('BASE_FLUSH_SIZE', '500')),
+    }
+    if name in ("file", "sqlite"):
+        options["snapshot_format"] = os.getenv('BASE_SNAPSHOT_FORMAT',
+                                               'json')
+    if name == "file":
+        options["journal_min_entries"] = int(
+            os.getenv('BASE_JOURNAL_MIN_ENTRIES', '1000'))
+    if name == "sqlite":
+        options["db_path"] = os.getenv('BASE_SHARED_DB', '.db.sqlite3')
+    return BACKENDS[name](**options)
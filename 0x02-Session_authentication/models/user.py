@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 """ User module
 """
+import hmac
 import hashlib
-from models.base import Base
+from concurrent.futures import Future
+from typing import Dict, Tuple
+from models import hashing
+from models.base import Base, data_lock
+
+BCRYPT = "bcrypt"
+SHA256 = "sha256"
 
 
 class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+    indexed_attributes = ('email',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -26,22 +36,92 @@ class User(Base):
 
     @password.setter
     def password(self, pwd: str):
-        """ Setter of a new password: encrypt in SHA256
+        """ Setter of a new password: encrypt with bcrypt
+
+        ValueError if the password is longer than 72 bytes.
         """
         if pwd is None or type(pwd) is not str:
-            self._password = None
+            hashed = None
         else:
-            self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+            hashed = self._bcrypt_format(hashing.hash_password(pwd))
+        with data_lock.write():
+            self._password = hashed
+
+    @staticmethod
+    def _bcrypt_format(hashed: bytes) -> str:
+        """ Stored form of a bcrypt hash: "bcrypt$<hash>"
+        """
+        return "{}${}".format(BCRYPT, hashed.decode())
+
+    def password_scheme(self) -> Tuple[str, str]:
+        """ Scheme and digest of the stored password
+
+        Hashes are stored as "<scheme>$<digest>". Unprefixed values are
+        legacy SHA256 hex digests.
+        """
+        if self._password is None:
+            return None, None
+        scheme, sep, digest = self._password.partition("$")
+        if sep and scheme in (BCRYPT, SHA256):
+            return scheme, digest
+        return SHA256, self._password
 
     def is_valid_password(self, pwd: str) -> bool:
         """ Validate a password
+
+        A valid legacy SHA256 password is upgraded to bcrypt in the
+        background and the user saved once the new hash is ready.
         """
         if pwd is None or type(pwd) is not str:
             return False
         if self.password is None:
             return False
+        scheme, digest = self.password_scheme()
+        if scheme == BCRYPT:
+            return hashing.is_valid(digest.encode(), pwd)
         pwd_e = pwd.encode()
-        return hashlib.sha256(pwd_e).hexdigest().lower() == self.password
+        if not hmac.compare_digest(
+                hashlib.sha256(pwd_e).hexdigest().lower(), digest.lower()):
+            return False
+        self._upgrade_password(pwd)
+        return True
+
+    def _upgrade_password(self, pwd: str) -> Future:
+        """ Rehash a legacy password with bcrypt on the hashing pool
+        """
+        legacy = self._password
+
+        def store(future: Future):
+            """ Keep the new hash unless the password changed meanwhile
+
+            The stored user is read again: with a shared store, a change
+            made by another process replaces it by a new object.
+            """
+            if future.exception() is not None:
+                return
+            current = type(self).get(self.id)
+            if current is None:
+                return
+            with data_lock.write():
+                if not current._is_stored() or current._password != legacy:
+                    return
+                current._password = self._bcrypt_format(future.result())
+            current.save()
+
+        future = hashing.hashing_service.hash_password_later(pwd)
+        future.add_done_callback(store)
+        return future
+
+    @classmethod
+    def password_report(cls) -> Dict[str, int]:
+        """ Number of users per password scheme
+
+        Users still on "sha256" are upgraded at their next login.
+        """
+        report = {BCRYPT: 0, SHA256: 0, "none": 0}
+        for user in cls.all():
+            report[user.password_scheme()[0] or "none"] += 1
+        return report
 
     def display_name(self) -> str:
         """ Display User name based on email/first_name/last_name
@@ -57,3 +137,9 @@ class User(Base):
             return "{}".format(self.last_name)
         else:
             return "{} {}".format(self.first_name, self.last_name)
+
+
+if __name__ == "__main__":
+    User.load_from_file()
+    for scheme, count in User.password_report().items():
+        print("{}: {}".format(scheme, count))
@@ -7,12 +7,14 @@
 from flask import Flask, jsonify, request, abort, redirect
 from flask_cors import (CORS, cross_origin)
 from auth import Auth
+from throttle import LoginThrottle
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 
 
 AUTH = Auth()
+THROTTLE = LoginThrottle.from_env()
 
 
 @app.route('/', methods=['GET'], strict_slashes=False)
@@ -41,10 +43,17 @@ def login() -> str:
     """
         If the login information is incorrect,
         use flask.abort to respond with a 401 HTTP status.
+        Throttled attempts get a 429 before the password is checked.
     """
     email, password = request.form.get("email"), request.form.get("password")
 
-    if not AUTH.valid_login(email, password):
+    if not THROTTLE.allow(email, request.remote_addr):
+        abort(429)
+    with THROTTLE.hash_slot() as acquired:
+        if not acquired:
+            abort(429)
+        valid = AUTH.valid_login(email, password)
+    if not valid:
         abort(401)
     session_id = AUTH.create_session(email)
     response = jsonify({"email": "email", "message": "logged in"})
@@ -5,9 +5,10 @@
     string arguments and returns bytes.
 """
 import uuid
-import bcrypt
 import base64
+import hashing
 from db import DB
+from single_flight import SingleFlight
 from user import User
 from typing import ByteString, Union
 from sqlalchemy.orm.exc import NoResultFound
@@ -18,7 +19,7 @@ def _hash_password(password: str) -> bytes:
         The returned bytes is a salted hash of the input password
         hashed with bcrypt.hashpw.
     """
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    return hashing.hash_password(password)
 
 
 def _generate_uuid() -> str:
@@ -32,6 +33,7 @@ class Auth:
 
     def __init__(self):
         self._db = DB()
+        self.login_flight = SingleFlight()
 
     def register_user(
         self,
@@ -54,16 +56,57 @@ class Auth:
         """
             Try locating the user by email. If it exists,
             check the password with bcrypt.checkpw
+            Concurrent checks of the same credentials share one result,
+            see login_flight.stats() for how many were coalesced.
+        """
+        if not isinstance(email, str) or not isinstance(password, str):
+            return False
+        key = self.login_flight.key(email, password)
+        return self.login_flight.do(key, self._check_login, email, password)
+
+    def _check_login(self, email: str, password: str) -> bool:
+        """
+            looks the user up by email and checks the password.
+        """
+        try:
+            user = self._db.find_user_by(email=email)
+            if user is not None:
+                if not hashing.is_valid(user.hashed_password, password):
+                    return False
+                self._upgrade_hash(user, password)
+                return True
+        except NoResultFound:
+            return False
+        return False
+
+    async def valid_login_async(self, email: str, password: str) -> bool:
+        """
+            valid_login for coroutines: the password check runs on the
+            hashing pool instead of blocking the event loop.
         """
         try:
             user = self._db.find_user_by(email=email)
             if user is not None:
-                return bcrypt.checkpw(
-                    password.encode('utf-8'), user.hashed_password)
+                if not await hashing.is_valid_async(
+                        user.hashed_password, password):
+                    return False
+                if hashing.needs_rehash(user.hashed_password):
+                    hashed = await hashing.hash_password_async(password)
+                    self._db.update_user(user.id, hashed_password=hashed)
+                return True
         except NoResultFound:
             return False
         return False
 
+    def _upgrade_hash(self, user: User, password: str) -> None:
+        """
+            After a successful login, hash the password again if it was
+            hashed with another bcrypt cost than the configured one.
+        """
+        if hashing.needs_rehash(user.hashed_password):
+            self._db.update_user(
+                user.id, hashed_password=_hash_password(password))
+
     def create_session(self, email: str) -> str:
         """
             returns the session ID as a string.